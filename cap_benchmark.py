@@ -0,0 +1,62 @@
+"""Benchmark the step time of the stock policies.
+
+Every policy plays against itself twice on the same seeds: once with its
+declared observation_type, and once forced to OBS_PARTIAL, which makes the
+environment build the vision masks and the entity index of both teams
+every step. The returned observation is not kept, as in cap_eval.py.
+"""
+
+import argparse
+import random
+import time
+
+import gym
+import gym_cap
+import numpy as np
+
+import gym_cap.envs.const as const
+import policy
+
+description = "Benchmark the step time of the stock policies."
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument('--policies', type=str, nargs='+', help='policies to benchmark',
+                    default=['Random', 'Zeros', 'AStar', 'Spiral', 'Patrol', 'Defense', 'Roomba'])
+parser.add_argument('--episode', type=int, help='number of episodes per run', default=20)
+parser.add_argument('--map_size', type=int, help='size of the board', default=20)
+parser.add_argument('--time_step', type=int, help='maximum time step (default:150)', default=150)
+parser.add_argument('--repeat', type=int, help='number of runs, the fastest is reported', default=3)
+args = parser.parse_args()
+
+def run(name, declared):
+    """ Return the fastest time per step (us) and the number of steps """
+    blue_policy = getattr(policy, name)()
+    red_policy = getattr(policy, name)()
+    if not declared:
+        blue_policy.observation_type = const.OBS_PARTIAL
+        red_policy.observation_type = const.OBS_PARTIAL
+    env = gym.make("cap-v0", map_size=args.map_size, policy_blue=blue_policy, policy_red=red_policy)
+
+    best = None
+    for _ in range(args.repeat):
+        np.random.seed(0)
+        random.seed(0)
+        env.seed(0)
+        steps, elapsed = 0, 0.0
+        for episode in range(args.episode):
+            env.reset()
+            start = time.perf_counter()
+            for _ in range(args.time_step):
+                steps += 1
+                if env.step()[2]:
+                    break
+            elapsed += time.perf_counter() - start
+        per_step = elapsed / steps * 1e6
+        best = per_step if best is None else min(best, per_step)
+    return best, steps
+
+print('{:10s} {:12s} {:>12s} {:>12s} {:>8s}'.format('policy', 'observation', 'declared', 'partial', 'steps'))
+for name in args.policies:
+    kind = getattr(policy, name).observation_type
+    declared, steps = run(name, True)
+    partial, _ = run(name, False)
+    print('{:10s} {:12s} {:9.1f} us {:9.1f} us {:8d}'.format(name, kind, declared, partial, steps))
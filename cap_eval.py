@@ -23,6 +23,7 @@ parser.add_argument('--config_path', type=str, help='configuration path', defaul
 parser.add_argument('--map_size', type=int, help='size of the board', default=20)
 parser.add_argument('--time_step', type=int, help='maximum time step (default:150)', default=150)
 parser.add_argument('--fair_map', help='run on fair map', action='store_true')
+parser.add_argument('--stalemate_steps', type=int, help='end an episode after this many steps without any move (0: never)', default=None)
 parser.add_argument('--cores', type=int, help='number of cores (-1 to use all)', default=1)
 args = parser.parse_args()
 
@@ -43,54 +44,49 @@ def _roll(n):
             policy_red = red_policy,
             config_path=args.config_path
         )
+    if args.stalemate_steps is not None:
+        env.STALEMATE_STEPS = args.stalemate_steps
     stat_win = np.array([0, 0, 0])
     stat_flag = np.array([0, 0, 0]) # Win mode
     stat_eliminated = np.array([0, 0, 0]) # Win mode
     ave_time = []
     ave_step = []
+    stalemate = 0
 
     for iterate in trange(num_episode, ncols=50, position=n):
-    #for iterate in range(num_episode):
-        if args.fair_map:
-            env.reset(custom_board=random.choice(fair_maps))
-        else:
-            env.reset()
-
+        # the whole episode is played inside the environment, without
+        # building the observations, rewards and info of the steps
         iter_time = time.time()
-        for steps in range(int(args.time_step)):
-            # feedback from environment
-            _, _, game_finish, _ = env.step()
-
-            if game_finish:
-                break 
-
+        record = env.rollout(int(args.time_step), custom_board=fair_maps if args.fair_map else None)[0]
         ave_time.append(time.time() - iter_time)
-        ave_step.append(steps)
-        
+        ave_step.append(record['steps'])
+        stalemate += record['stalemate']
+
         stat_win += np.array([
-                env.blue_win,
-                not (env.blue_win or env.red_win),
-                env.red_win
+                record['blue_win'],
+                not (record['blue_win'] or record['red_win']),
+                record['red_win']
             ])
         stat_flag += np.array([
-                env.red_flag_captured,
-                not (env.blue_flag_captured or env.red_flag_captured),
-                env.blue_flag_captured
+                record['red_flag_captured'],
+                not (record['blue_flag_captured'] or record['red_flag_captured']),
+                record['blue_flag_captured']
             ])
         stat_eliminated += np.array([
-                env.red_eliminated,
-                not (env.blue_eliminated or env.red_eliminated),
-                env.blue_eliminated
+                record['red_eliminated'],
+                not (record['blue_eliminated'] or record['red_eliminated']),
+                record['blue_eliminated']
             ])
     env.close()
 
-    return stat_win, stat_flag, stat_eliminated, ave_time, ave_step
+    return stat_win, stat_flag, stat_eliminated, ave_time, ave_step, stalemate
 
 stat_win = np.array([0, 0, 0])
 stat_flag = np.array([0, 0, 0]) # Win mode
 stat_eliminated = np.array([0, 0, 0]) # Win mode
 ave_time = []
 ave_step = []
+stalemate = 0
 
 if args.cores == -1:
     cores = multiprocessing.cpu_count()
@@ -106,6 +102,7 @@ if cores > 1:
             stat_eliminated += result[2]
             ave_time.extend(result[3])
             ave_step.extend(result[4])
+            stalemate += result[5]
 else:
     result = _roll(0)
     stat_win += result[0]
@@ -113,6 +110,7 @@ else:
     stat_eliminated += result[2]
     ave_time.extend(result[3])
     ave_step.extend(result[4])
+    stalemate += result[5]
 
 stat_win        = np.stack([stat_win, 100*stat_win/sum(stat_win)]).flatten('F')
 stat_flag       = np.stack([stat_flag, 100*stat_flag/sum(stat_flag)]).flatten('F')
@@ -124,5 +122,6 @@ str_format = "{:<12}     | BLUE : {:<6.0f}({:<4.1f}%) | DRAW : {:<6.0f}({:<4.1f}
 print(str_format.format('OVERALL', *stat_win))
 print(str_format.format('WIN BY FLAG', *stat_flag))
 print(str_format.format('WIN BY KILL', *stat_eliminated))
+print("Stalemate        : {} (ended early, counted as draw)".format(stalemate))
 print("Average Run Time : {:.5f} ± {:.5f} sec".format(np.mean(ave_time), np.std(ave_time)))
 print("Average Step     : {:.5f} ± {:.5f} sec".format(np.mean(ave_step), np.std(ave_step)))
@@ -107,12 +107,7 @@ class CtfNode:
         return locations
 
     def get_obstacle_positions(self):
-        locations = []
-
-        for y in range(len(self.env._env)):
-            for x in range(len(self.env._env[0])):
-                if self.env._env[x][y] == 8:
-                    locations.append([x,y])
+        locations = self.env.get_map_index.obstacles.tolist()
 
         return locations
 
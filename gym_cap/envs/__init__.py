@@ -1 +1,2 @@
 from gym_cap.envs.cap_env import *
+from gym_cap.envs.vector_env import CapVecEnv
@@ -1,20 +1,193 @@
 # from gym import error, spaces, utils
 # from gym.utils import seeding
 # from .cap_view2d import CaptureView2D
+import operator
+
 from .const import *
 import numpy as np
 # from .create_map import CreateMap
 #from .enemy_ai import EnemyAI
-import math
+
+_DISK_STENCIL = {}
+
+def disk_stencil(radius):
+    """
+    Boolean stencil of the cells (i, j) with i*i + j*j <= radius**2
+
+    The stencil has shape (2*radius+1, 2*radius+1) and is cached by radius.
+    """
+    stencil = _DISK_STENCIL.get(radius)
+    if stencil is None:
+        i, j = np.ogrid[-radius:radius+1, -radius:radius+1]
+        stencil = i*i + j*j <= radius*radius
+        stencil.setflags(write=False)
+        _DISK_STENCIL[radius] = stencil
+    return stencil
+
+def stamp_disk(mask, cx, cy, radius):
+    """
+    Set the cells of the mask within the radius from (cx, cy) to True
+
+    The part of the disk outside of the mask is clipped.
+    """
+    stencil = disk_stencil(radius)
+    l, b = mask.shape
+    x0, x1 = max(cx-radius, 0), min(cx+radius+1, l)
+    y0, y1 = max(cy-radius, 0), min(cy+radius+1, b)
+    if x0 >= x1 or y0 >= y1:
+        return
+    mask[x0:x1, y0:y1] |= stencil[x0-cx+radius:x1-cx+radius, y0-cy+radius:y1-cy+radius]
+
+def add_disk(array, cx, cy, radius, value=1):
+    """
+    Add the value to the cells of the array within the radius from (cx, cy)
+
+    The part of the disk outside of the array is clipped.
+    """
+    stencil = disk_stencil(radius)
+    l, b = array.shape
+    x0, x1 = max(cx-radius, 0), min(cx+radius+1, l)
+    y0, y1 = max(cy-radius, 0), min(cy+radius+1, b)
+    if x0 >= x1 or y0 >= y1:
+        return
+    array[x0:x1, y0:y1] += value * stencil[x0-cx+radius:x1-cx+radius, y0-cy+radius:y1-cy+radius]
+
+def dilate_disk(mask, radius):
+    """
+    Cells of the array within the radius from any cell of the mask
+    """
+    out = mask.copy()
+    l, b = mask.shape
+    for dx, dy in np.argwhere(disk_stencil(radius)) - radius:
+        out[max(dx, 0):l+min(dx, 0), max(dy, 0):b+min(dy, 0)] |= \
+                mask[max(-dx, 0):l+min(-dx, 0), max(-dy, 0):b+min(-dy, 0)]
+    return out
+
+MOVE_KERNEL_SIZE = 256
+_ACTION_DELTA = np.array(ACTION_DELTA)
+_MOVE_STATE = operator.attrgetter('x', 'y', 'step', 'isAlive', 'air', 'team')
+# Channel and mark of the units by [team][air]
+_UNIT_CHANNEL = ELEMENT_CHANNEL[UNIT_ELEMENT].tolist()
+_UNIT_ICON = ELEMENT_REPRESENT[UNIT_ELEMENT].tolist()
+_DEAD_CHANNEL, _DEAD_ICON = int(ELEMENT_CHANNEL[DEAD]), int(ELEMENT_REPRESENT[DEAD])
+
+def move_units(units, actions, env, static_map, vectorized=None):
+    """
+    Move the units at once, with the outcome of Agent.move called in order
+
+    A ground unit cannot enter a cell of the UGV channel which is occupied
+    at its turn, so the cell can be freed by an earlier unit of the list or
+    taken by it. The outcome of every unit is found from the writes of the
+    units before it; the outcome is assumed successful for every unit first
+    and it is refined until it is stable, which takes one more pass than
+    the longest chain of units waiting on each other.
+
+    The NumPy kernel has a fixed cost of about a hundred microseconds, so
+    lists shorter than MOVE_KERNEL_SIZE are moved with Agent.move.
+
+    Parameters
+    ----------
+    units       : list
+        Agent objects, in the order of the moves
+    actions     : list
+        index of the action of each unit
+    env         : ndarray
+        (h, w, NUM_CHANNEL) environment, updated in place
+    static_map  : ndarray
+        2d static map
+    vectorized  : bool
+        force (True) or disable (False) the NumPy kernel
+    """
+    n = len(units)
+    if n == 0:
+        return
+    actions = np.asarray(actions, dtype=int).reshape(n)
+    if vectorized is None:
+        vectorized = n >= MOVE_KERNEL_SIZE
+    if not vectorized:
+        for unit, action in zip(units, actions.tolist()):
+            unit.move(action, env, static_map)
+        return
+
+    length, width = static_map.shape
+    num_channel = env.shape[2]
+
+    state = np.array(list(map(_MOVE_STATE, units)), dtype=int)
+    pos, step = state[:, :2], state[:, 2]
+    alive, air = state[:, 3] == 1, state[:, 4] == 1
+    element = UNIT_ELEMENT[state[:, 5], state[:, 4]]
+    ch, icon = ELEMENT_CHANNEL[element], ELEMENT_REPRESENT[element]
+
+    valid = (actions >= 0) & (actions < len(ACTION_DELTA))
+    if not valid.all():
+        for _ in range(np.count_nonzero(alive & ~valid)):
+            print("error: wrong action selected")
+        actions = np.where(valid, actions, 0)
+    target = pos + _ACTION_DELTA[actions] * step[:, None]
+    np.maximum(target, 0, out=target)
+    np.minimum(target, (length-1, width-1), out=target)
+    candidate = alive & valid & (target != pos).any(axis=1)
+    candidate &= air | (static_map[target[:, 0], target[:, 1]] != OBSTACLE)
+
+    # Flat index of the (x, y, channel) cells, and the order of the writes:
+    # 2i to clear the cell left by unit i, 2i+1 to mark its new cell
+    source = (pos[:, 0] * width + pos[:, 1]) * num_channel + ch
+    dest = (target[:, 0] * width + target[:, 1]) * num_channel + ch
+    order = np.arange(n) * 2
+    span = 2 * n
+    query = np.flatnonzero(candidate & ~air)
+
+    success = candidate
+    while True:
+        clear = ~alive | success
+        keys = np.concatenate([source[clear] * span + order[clear],
+                               dest[success] * span + order[success] + 1])
+        values = np.concatenate([np.zeros(np.count_nonzero(clear), dtype=int), icon[success]])
+        sort = np.argsort(keys)
+        keys, values = keys[sort], values[sort]
+
+        # Value of the target cell at the turn of each ground unit
+        last = np.searchsorted(keys, dest[query] * span + order[query]) - 1
+        written = last >= 0
+        written[written] = keys[last[written]] // span == dest[query[written]]
+        value = env.flat[dest[query]]
+        value[written] = values[last[written]]
+        occupied = value != 0
+
+        refined = candidate.copy()
+        refined[query[occupied]] = False
+        if np.array_equal(refined, success):
+            break
+        success = refined
+
+    # Dead units clear their mark of the DEAD channel
+    if not alive.all():
+        dead = pos[~alive]
+        dead_cell = env[dead[:, 0], dead[:, 1], _DEAD_CHANNEL] == _DEAD_ICON
+        env[dead[dead_cell, 0], dead[dead_cell, 1], _DEAD_CHANNEL] = 0
+
+    # Apply the last write of every cell
+    if len(keys):
+        cells = keys // span
+        final = np.append(cells[1:] != cells[:-1], True)
+        env.flat[cells[final]] = values[final]
+    for idx, (x, y) in zip(np.flatnonzero(success).tolist(), target[success].tolist()):
+        unit = units[idx]
+        unit.x, unit.y = x, y
 
 class Agent:
     """This is a parent class for all agents.
     It creates an instance of agent in specific location"""
 
+    __slots__ = ('isAlive', 'x', 'y', 'step', 'range', 'a_range', 'air', 'memory',
+                 'memory_mode', 'team', 'marker', 'move_selected')
+
     def __init__(self, loc, map_only, team_number):
         """
         Constructor
 
+        The individual memory is not allocated until init_memory is called.
+
         Parameters
         ----------
         self    : object
@@ -28,7 +201,7 @@ class Agent:
         self.range = UGV_RANGE
         self.a_range = UGV_A_RANGE
         self.air = False
-        self.memory = np.empty_like(map_only)
+        self.memory = None
         self.memory_mode = "None"
         #self.ai = EnemyAI(map_only)
         self.team = team_number
@@ -43,8 +216,8 @@ class Agent:
         ----------
         self        : object
             CapEnv object
-        action      : string
-            Action the unit is to take
+        action      : int or string
+            Index of the action in ["X", "N", "E", "S", "W"], or its name
         env         : list
             the environment to move units in
         static_map   : list
@@ -53,67 +226,55 @@ class Agent:
 
 
         # Define channel and represented number
-        if self.air:
-            ch = CHANNEL[TEAM1_UAV] if self.team == TEAM1_BACKGROUND else CHANNEL[TEAM2_UAV]
-            icon = REPRESENT[TEAM1_UAV] if self.team == TEAM1_BACKGROUND else REPRESENT[TEAM2_UAV]
-        else:
-            ch = CHANNEL[TEAM1_UGV] if self.team == TEAM1_BACKGROUND else CHANNEL[TEAM2_UGV]
-            icon = REPRESENT[TEAM1_UGV] if self.team == TEAM1_BACKGROUND else REPRESENT[TEAM2_UGV]
+        ch = _UNIT_CHANNEL[self.team][self.air]
+        icon = _UNIT_ICON[self.team][self.air]
 
         # If agent is dead, dont move
         if not self.isAlive:
-            dead_channel = CHANNEL[DEAD]
-            if env[self.x][self.y][dead_channel] == REPRESENT[DEAD]:
-                env[self.x][self.y][dead_channel] = 0
+            if env[self.x][self.y][_DEAD_CHANNEL] == _DEAD_ICON:
+                env[self.x][self.y][_DEAD_CHANNEL] = 0
             env[self.x][self.y][ch] = 0
             return
-        
-        if action == "X":
-            pass
-        
-        elif action in ["N", "S", "E", "W"]:
-            new_coord = {"N": [self.x, self.y - self.step],
-                         "S": [self.x, self.y + self.step],
-                         "E": [self.x + self.step, self.y],
-                         "W": [self.x - self.step, self.y]}
-            new_coord = new_coord[action]
-
-            # Out of bound 
-            length, width = static_map.shape
-            if new_coord[0] < 0: new_coord[0] = 0
-            if new_coord[1] < 0: new_coord[1] = 0
-            if new_coord[0] >= length: new_coord[0] = length-1
-            if new_coord[1] >= width: new_coord[1] = width-1
-            new_coord = tuple(new_coord)
-
-            # Not able to move
-            if (self.x, self.y) == new_coord: return
-            # if self.air and env[new_coord[0], new_coord[1], ch] != 0: return
-            if not self.air and env[new_coord[0], new_coord[1], ch] != 0: return
-            if not self.air and static_map[new_coord] == OBSTACLE: return
-
-            # Make a movement
-            env[self.x, self.y, ch] = 0
-            self.x, self.y = new_coord
-            env[self.x, self.y, ch] = icon
-        else:
+
+        if type(action) is str:
+            action = ACTION_INDEX.get(action, -1)
+        if not 0 <= action < len(ACTION_DELTA):
             print("error: wrong action selected")
+            return
+        dx, dy = ACTION_DELTA[action]
+        if dx == 0 and dy == 0:
+            return
+
+        # Out of bound
+        length, width = static_map.shape
+        new_coord = (min(max(self.x + dx * self.step, 0), length-1),
+                     min(max(self.y + dy * self.step, 0), width-1))
+
+        # Not able to move
+        if (self.x, self.y) == new_coord: return
+        # if self.air and env[new_coord[0], new_coord[1], ch] != 0: return
+        if not self.air and env[new_coord[0], new_coord[1], ch] != 0: return
+        if not self.air and static_map[new_coord] == OBSTACLE: return
+
+        # Make a movement
+        env[self.x, self.y, ch] = 0
+        self.x, self.y = new_coord
+        env[self.x, self.y, ch] = icon
     
+    def init_memory(self, map_size):
+        """
+        Allocate the fog memory of the agent, with every cell UNKNOWN
+        """
+        self.memory = np.full(map_size, UNKNOWN, dtype=np.int8)
+        self.memory_mode = "fog"
+
     def update_memory(self, env):
         """
         saves/updates individual map of an agent
 
         """
         
-        obs = self.get_obs(env=env)
-        leng, breth = obs.shape
-        leng, breth = leng//2, breth//2
-        l, b = self.memory.shape
-        loc_x, loc_y = self.get_loc()
-        offset_x, offset_y = leng - loc_x, breth - loc_y
-        obs = obs[offset_x: offset_x + l, offset_y: offset_y + b]    
-        coord = obs != UNKNOWN
-        self.memory[coord] = env._static_map[coord]
+        np.copyto(self.memory, env._static_map, where=self.get_vision(env=env))
 
         return
     
@@ -153,97 +314,78 @@ class Agent:
     def report_loc(self):
         print("report: position x:%d, y:%d" % (self.x, self.y))
 
-    def get_obs(self, env):
-        com_air = env.COM_AIR
-        com_ground = env.COM_GROUND
-        com_distance = env.COM_DISTANCE
-        com_frequency = env.COM_FREQUENCY
+    def get_vision(self, env):
+        """
+        Cells of the map seen by the agent in the current step
 
-        if self.team == BLUE:
-            myTeam = env.get_team_blue
-        else:
-            myTeam = env.get_team_red
+        The mask is aligned with the map and includes the vision shared
+        through the team's communication graph. It is computed once per step
+        and cached by the environment, and it is read-only.
+        """
+        vision = env._vision_cache.get(id(self))
+        if vision is not None:
+            return vision
+
+        h, w = env.map_size
+        vision = np.zeros((h, w), dtype=bool)
+        if self.isAlive:
+            x, y = self.get_loc()
+            stamp_disk(vision, x, y, self.range)
+            if env.COM_GROUND or env.COM_AIR:
+                graph = env._communication_graph(self.team)
+                vision |= graph.received_vision(self)[h-1:2*h-1, w-1:2*w-1]
+        vision.setflags(write=False)
+        env._vision_cache[id(self)] = vision
+        return vision
 
-        a = 39              # env.map_size[0]*2-1
-        b = 39              # env.map_size[1]*2-1
-        obs = np.full(shape=(a, b), fill_value=UNKNOWN)
-        val = env.get_full_state
+    def get_obs(self, env):
+        """
+        Egocentric observation of the agent
 
-        if not self.isAlive:        # if target agent is dead, return all -1
-            return obs
+        The window is (2*h-1, 2*w-1) for the map of size (h, w), and the agent
+        is always at its center (h-1, w-1). Cells seen by the agent are copied
+        from the full state, and other cells are UNKNOWN.
 
-        loc = self.get_loc()
-        x, y = loc[0], loc[1]
-        for i in range(-self.range, self.range + 1):
-            for j in range(-self.range, self.range + 1):
-                locx, locy = i + loc[0], j + loc[1]
-                if (i * i + j * j <= self.range ** 2) and \
-                        not (locx < 0 or locx > env.map_size[0] - 1) and \
-                        not (locy < 0 or locy > env.map_size[1] - 1):
-                    obs[locx+int(a/2)-loc[0]][locy+int(b/2)-loc[1]] = val[locx][locy]
-                else:
-                    obs[locx + int(a/2) - loc[0]][locy + int(b/2) - loc[1]] = UNKNOWN
-
-        if not com_ground and not com_air:
+        If communication is allowed, the vision shared through the team's
+        communication graph is added. Shared cells beyond the map are seen as
+        OBSTACLE, and shared cells are lost with probability 1-COM_FREQUENCY.
+
+        The observation is computed once per step and cached by the
+        environment, and it is read-only.
+        """
+        obs = env._obs_cache.get(id(self))
+        if obs is not None:
             return obs
 
-        for agent in myTeam:
-            if not agent.isAlive:
-                continue
-            loc = agent.get_loc()
-            if not com_distance == -1:
-                if math.hypot(loc[0] - x, loc[1] - y) < com_distance:
-                    continue
-            if not com_air and agent.air:
-                continue
-            elif com_air and agent.air:
-                for i in range(-agent.range, agent.range + 1):
-                    for j in range(-agent.range, agent.range + 1):
-                        locx, locy = i + loc[0], j + loc[1]
-                        coordx = locx + int(a / 2) - x
-                        coordy = locy + int(b / 2) - y
-                        if (i * i + j * j <= agent.range ** 2) and \
-                                not (locx < 0 or locx > env.map_size[0] - 1) and \
-                                not (locy < 0 or locy > env.map_size[1] - 1):
-                            obs[coordx][coordy] = val[locx][locy]
-
-                            if com_frequency is not None and np.random.random() > com_frequency:
-                                obs[coordx][coordy] = UNKNOWN
-
-                        elif (0 <= coordx < a) and (0 <= coordy < b):
-                            obs[coordx][coordy] = OBSTACLE
-
-                            if com_frequency is not None and np.random.random() > com_frequency:
-                                obs[coordx][coordy] = UNKNOWN
-
-            elif not com_ground and not agent.air:
-                continue
-            elif com_ground and not agent.air:
-                for i in range(-agent.range, agent.range + 1):
-                    for j in range(-agent.range, agent.range + 1):
-                        locx, locy = i + loc[0], j + loc[1]
-                        coordx = locx + int(a / 2) - x
-                        coordy = locy + int(b / 2) - y
-                        if (i * i + j * j <= agent.range ** 2) and \
-                                not (locx < 0 or locx > env.map_size[0] - 1) and \
-                                not (locy < 0 or locy > env.map_size[1] - 1):
-                            obs[coordx][coordy] = val[locx][locy]
-
-                            if com_frequency is not None and np.random.random() > com_frequency:
-                                obs[coordx][coordy] = UNKNOWN
-
-                        elif (0 <= coordx < a) and (0 <= coordy < b):
-                            obs[coordx][coordy] = OBSTACLE
-
-                            if com_frequency is not None and np.random.random() > com_frequency:
-                                obs[coordx][coordy] = UNKNOWN
+        h, w = env.map_size
+        a, b = 2*h - 1, 2*w - 1
+        obs = np.full(shape=(a, b), fill_value=UNKNOWN)
 
+        if self.isAlive:
+            # Part of the window which overlaps the map
+            x, y = self.get_loc()
+            on_map = (slice(h-1-x, 2*h-1-x), slice(w-1-y, 2*w-1-y))
+            coord = self.get_vision(env)
+            obs[on_map][coord] = env._step_full_state()[coord]
+
+            if env.COM_GROUND or env.COM_AIR:
+                graph = env._communication_graph(self.team)
+                shared = graph.received_vision(self)[x:x+a, y:y+b].copy()
+                own = np.zeros((a, b), dtype=bool)
+                stamp_disk(own, h-1, w-1, self.range)
+                shared[on_map] = False
+                obs[shared & ~own] = OBSTACLE
+
+        obs.setflags(write=False)
+        env._obs_cache[id(self)] = obs
         return obs
 
 class GroundVehicle(Agent):
     """This is a child class for ground agents. Inherited from Agent class.
     It creates an instance of UGV in specific location"""
 
+    __slots__ = ()
+
     def __init__(self, loc, map_only, team_number):
         """
         Constructor
@@ -261,6 +403,8 @@ class AerialVehicle(Agent):
     """This is a child class for aerial agents. Inherited from Agent class.
     It creates an instance of UAV in specific location"""
 
+    __slots__ = ()
+
     def __init__(self, loc, map_only, team_number):
         """
         Constructor
@@ -281,6 +425,8 @@ class CivilAgent(GroundVehicle):
     """This is a child class for civil agents. Inherited from UGV class.
     It creates an instance of civil in specific location"""
 
+    __slots__ = ('direction', 'isDone')
+
     def __init__(self, loc, map_only, team_number):
         """
         Constructor
@@ -16,7 +16,12 @@ from gym.utils import seeding
 import numpy as np
 
 from .agent import *
+from .communication import CommunicationGraph
 from .create_map import CreateMap
+from .entity_index import EntityIndex
+from .map_index import MapIndex
+from .memory import TeamMemory
+from .observation import LazyObservation
 from gym_cap.envs import const
 
 """
@@ -24,6 +29,15 @@ Requires that all units initially exist in home zone.
 """
 
 
+# Code of a unit by [team][air]
+_UNIT_CODE = UNIT_ELEMENT.tolist()
+# Channel representation of an UNKNOWN cell
+_UNKNOWN_CELL = CreateMap.flat_to_channel([[UNKNOWN]])[0, 0]
+# Sign of each channel in the perspective of [blue, red] (team channels flipped for red)
+_PERSPECTIVE = np.ones((2, NUM_CHANNEL), dtype=int)
+_PERSPECTIVE[TEAM2_BACKGROUND, ELEMENT_CHANNEL[[TEAM1_BACKGROUND, TEAM1_UGV, TEAM1_UAV, TEAM1_FLAG]]] = -1
+
+
 class CapEnv(gym.Env):
     metadata = {
         "render.modes": ["fast", "human", 'rgb_array'],
@@ -44,15 +58,14 @@ class CapEnv(gym.Env):
         self.viewer = None
         self._parse_config()
 
-        self.blue_memory = np.empty((map_size, map_size))
-        self.red_memory = np.empty((map_size, map_size))
-
         self._policy_blue = None
         self._policy_red = None
 
         self._blue_trajectory = []
         self._red_trajectory = []
 
+        self._state_id = 0
+
         self.reset(
                 map_size,
                 mode=mode,
@@ -88,19 +101,20 @@ class CapEnv(gym.Env):
 
         config_param = { # Configurable parameters
                 'elements': ['NUM_BLUE', 'NUM_RED', 'NUM_UAV', 'NUM_GRAY'],
-                'control': ['CONTROL_ALL'],
-                'communication': ['COM_GROUND', 'COM_AIR', 'COM_DISTANCE', 'COM_FREQUENCY'],
+                'control': ['CONTROL_ALL', 'MULTI_DISCRETE', 'LAZY_OBSERVATION'],
+                'communication': ['COM_GROUND', 'COM_AIR', 'COM_DISTANCE', 'COM_FREQUENCY', 'COM_MULTIHOP'],
                 'memory': ['INDIV_MEMORY', 'TEAM_MEMORY', 'RENDER_INDIV_MEMORY', 'RENDER_TEAM_MEMORY'],
                 'settings': ['RL_SUGGESTIONS', 'STOCH_TRANSITIONS', 'STOCH_TRANSITIONS_EPS',
-                        'STOCH_ATTACK', 'STOCH_ATTACK_BIAS', 'STOCH_ZONES', 'RED_PARTIAL', 'BLUE_PARTIAL']
+                        'STOCH_ATTACK', 'STOCH_ATTACK_BIAS', 'STOCH_ZONES', 'RED_PARTIAL', 'BLUE_PARTIAL',
+                        'STALEMATE_STEPS']
             }
         config_datatype = {
                 'elements': [int, int, int ,int],
-                'control': [bool],
-                'communication': [bool, bool, int, float],
+                'control': [bool, bool, bool],
+                'communication': [bool, bool, int, float, bool],
                 'memory': [str, str, bool, bool],
                 'settings': [bool, bool, float,
-                        bool, int, bool, bool, bool]
+                        bool, int, bool, bool, bool, int]
             }
 
         if config_path is None:
@@ -134,10 +148,9 @@ class CapEnv(gym.Env):
 
         :param map_size: Size of the map
         :param mode: Action generation mode
-        :return: void
+        :return: observation of blue team (LazyObservation with LAZY_OBSERVATION)
 
         """
-
         # ASSERTIONS
 
         # WARNINGS
@@ -168,13 +181,25 @@ class CapEnv(gym.Env):
             self.NUM_BLUE, self.NUM_UAV, self.NUM_RED, self.NUM_UAV, self.NUM_GRAY = map_obj
 
         self.map_size = tuple(self._static_map.shape)
-        self.action_space = spaces.Discrete(len(self.ACTION) ** (map_obj[0] + map_obj[1]))
+        self._board_channels = np.copy(self._env)
+        self._board_channels[:, :, [CHANNEL[TEAM1_UGV], CHANNEL[TEAM1_UAV]]] = 0
+        self._board_channels.setflags(write=False)
+        self._map_index = MapIndex.from_map(self._static_map)
+        if self.MULTI_DISCRETE:
+            num_control = map_obj[0] + map_obj[1]
+            if self.CONTROL_ALL:
+                num_control += map_obj[2] + map_obj[3]
+            self.action_space = spaces.MultiDiscrete([len(self.ACTION)] * num_control)
+        else:
+            self.action_space = spaces.Discrete(len(self.ACTION) ** (map_obj[0] + map_obj[1]))
         self.observation_space = Board(shape=[self.map_size[0], self.map_size[1], NUM_CHANNEL])
         if map_obj[2] == 0:
             self.mode = "sandbox"
 
         # INITIALIZE TEAM
         self._team_blue, self._team_red = self._construct_agents(agent_locs, self._static_map)
+        self._team_blue_view, self._team_red_view = tuple(self._team_blue), tuple(self._team_red)
+        self._clear_step_cache()
 
         # INITIALIZE POLICY
         if policy_blue is not None:
@@ -190,21 +215,24 @@ class CapEnv(gym.Env):
                 print("Red policy does not have Policy_gen object", e)
                 raise
 
-        # INITIALIZE MEMORY
+        # INITIALIZE MEMORY (only allocated for fog memory)
+        self.blue_memory = self.red_memory = None
+        self._team_memory_blue = self._team_memory_red = None
         if self.TEAM_MEMORY == "fog":
-            self.blue_memory[:] = const.UNKNOWN
-            self.red_memory[:] = const.UNKNOWN
+            self.blue_memory = np.full(self.map_size, const.UNKNOWN, dtype=np.int8)
+            self.red_memory = np.full(self.map_size, const.UNKNOWN, dtype=np.int8)
+            self._team_memory_blue = TeamMemory(self.map_size)
+            self._team_memory_red = TeamMemory(self.map_size)
 
         if self.INDIV_MEMORY == "fog":
             for agent in self._team_blue + self._team_red:
-                agent.memory[:] = const.UNKNOWN
-                agent.memory_mode = "fog"
+                agent.init_memory(self.map_size)
 
         # INITIATE POLICY
         if self._policy_blue is not None:
-            self._policy_blue.initiate(self._static_map, self._team_blue)
+            self._policy_blue.initiate(self._static_map, self._team_blue, map_index=self._map_index)
         if self._policy_red is not None:
-            self._policy_red.initiate(self._static_map, self._team_red)
+            self._policy_red.initiate(self._static_map, self._team_red, map_index=self._map_index)
 
         # INITIALIZE TRAJECTORY
         self._blue_trajectory = []
@@ -218,13 +246,19 @@ class CapEnv(gym.Env):
         self.blue_flag_captured = False
         self.red_eliminated = False
         self.blue_eliminated = False
+        self.stalemate = False
+
+        # Stalemate detection
+        self._still_steps = 0
+        self._last_positions = self._unit_positions()
+        self._contact = None
 
         # Necessary for human mode
         self.first = True
 
         self.run_step = 0  # Number of step of current episode
 
-        return self.get_obs_blue
+        return self._lazy_obs(TEAM1_BACKGROUND)
 
     def _construct_agents(self, agent_coords, static_map):
         """
@@ -258,53 +292,328 @@ class CapEnv(gym.Env):
 
         return team_blue, team_red
 
-    def _create_observation_mask(self):
+    def _clear_step_cache(self):
         """
-        Creates the mask 
+        Drop everything computed from the current state of the units
 
-        Mask is True(1) for the location where it CANNOT see.
-        For full observation setting, mask is zero matrix
+        Must be called whenever units move or die.
+        """
+        self._state_id += 1
+        self._comm_graphs = {}
+        self._threat_maps = {}
+        self._entity_indices = {}
+        self._action_masks = {}
+        self._vision_cache = {}
+        self._obs_cache = {}
+        self._full_state_cache = None
+
+    def _step_full_state(self):
+        """Full state of the current step, shared by the observations."""
+        if self._full_state_cache is None:
+            self._full_state_cache = self._env_flat()
+            self._full_state_cache.setflags(write=False)
+        return self._full_state_cache
+
+    def _agent_states(self, team):
+        """
+        Stacked state of the units of the team
+
+        Returns an (n_units, 5) int array with the columns STATE_X, STATE_Y,
+        STATE_TEAM, STATE_ALIVE and STATE_AIR, in the order of the team list.
+        """
+        members = self._team_blue if team == TEAM1_BACKGROUND else self._team_red
+        states = [(agent.x, agent.y, agent.team, agent.isAlive, agent.air) for agent in members]
+        return np.array(states, dtype=int).reshape(len(members), 5)
+
+    def _unit_snapshot(self):
+        """
+        Copy of the units, enough to rebuild _env with _restore_env
+
+        The moves only write the unit channels at the cells of the units, so
+        _env is the board of the reset with the unit channel of every unit
+        (alive or dead) at its cell.
+
+        Return
+        ______
+        board   : ndarray
+            _env of the reset without the units (read-only)
+        states  : dict
+            _agent_states of each team
+        values  : ndarray
+            value of the unit channel at the cell of each unit, blue first
+        """
+        states = {team: self._agent_states(team) for team in (TEAM1_BACKGROUND, TEAM2_BACKGROUND)}
+        cells = np.concatenate([states[TEAM1_BACKGROUND], states[TEAM2_BACKGROUND]])
+        channel = np.where(cells[:, STATE_AIR], CHANNEL[TEAM1_UAV], CHANNEL[TEAM1_UGV])
+        values = self._env[cells[:, STATE_X], cells[:, STATE_Y], channel]
+        return self._board_channels, states, values
+
+    @staticmethod
+    def _restore_env(snapshot):
+        """ _env at the time of the _unit_snapshot """
+        board, states, values = snapshot
+        env = np.copy(board)
+        cells = np.concatenate([states[TEAM1_BACKGROUND], states[TEAM2_BACKGROUND]])
+        channel = np.where(cells[:, STATE_AIR], CHANNEL[TEAM1_UAV], CHANNEL[TEAM1_UGV])
+        env[cells[:, STATE_X], cells[:, STATE_Y], channel] = values
+        return env
+
+    def _communication_graph(self, team):
+        """
+        Communication graph of the team for the current step
+
+        The graph is built once per step and shared by every unit of the team.
 
         Parameters
         ----------
         self    : object
             CapEnv object
         team    : int
-            Team to create obs space for
+            TEAM1_BACKGROUND or TEAM2_BACKGROUND
+        """
+        graph = self._comm_graphs.get(team)
+        if graph is None:
+            members = self._team_blue if team == TEAM1_BACKGROUND else self._team_red
+            graph = CommunicationGraph(members, self.map_size,
+                    self.COM_GROUND, self.COM_AIR, self.COM_DISTANCE,
+                    self.COM_MULTIHOP, self.COM_FREQUENCY, self.np_random)
+            self._comm_graphs[team] = graph
+        return graph
+
+    def _threat_map(self, team):
         """
+        Threat map of the team for the current step
 
-        def create_vision_mask(centers, radii):
-            h, w = self._static_map.shape
-            mask = np.zeros([h,w], dtype=bool)
-            Y, X = np.ogrid[:h, :w]
-            for center, radius in zip(centers, radii):
-                mask += np.sqrt((X - center[1])**2 + (Y-center[0])**2) <= radius
-            return ~mask
+        Number of visible enemy ground units whose attack range covers each
+        cell, adjusted for the territory as in `_interaction`:
+        without STOCH_ATTACK, units cannot be killed in their own territory
+        and the threat is zero there. With STOCH_ATTACK, the enemy gets the
+        STOCH_ATTACK_BIAS outside of the team territory wherever it has a
+        unit in range.
 
-        if self.BLUE_PARTIAL:
-            centers, radii = [], []
-            for agent in self._team_blue:
-                if not agent.isAlive: continue
-                centers.append(agent.get_loc())
-                radii.append(agent.range)
-            self._blue_mask = create_vision_mask(centers, radii)
+        The map is built once per step for each team and it is read-only.
+        """
+        threat = self._threat_maps.get(team)
+        if threat is not None:
+            return threat
+
+        if team == TEAM1_BACKGROUND:
+            enemy_list, mask = self._team_red, self._blue_mask
         else:
-            self._blue_mask = np.zeros_like(self._static_map, dtype=bool)
+            enemy_list, mask = self._team_blue, self._red_mask
 
-        if self.RED_PARTIAL:
-            centers, radii = [], []
-            for agent in self._team_red:
-                if not agent.isAlive: continue
-                centers.append(agent.get_loc())
-                radii.append(agent.range)
-            self._red_mask = create_vision_mask(centers, radii)
+        threat = np.zeros(self.map_size, dtype=np.int16)
+        for enemy in enemy_list:
+            if enemy.air or not enemy.isAlive: continue
+            if mask[enemy.get_loc()]: continue
+            add_disk(threat, enemy.x, enemy.y, enemy.a_range)
+
+        territory = self._static_map == team
+        if self.STOCH_ATTACK:
+            threat[(threat > 0) & ~territory] += self.STOCH_ATTACK_BIAS
         else:
-            self._red_mask = np.zeros_like(self._static_map, dtype=bool)
+            threat[territory] = 0
+        threat.setflags(write=False)
+        self._threat_maps[team] = threat
+        return threat
+
+    def _lazy_obs(self, team):
+        """
+        Observation of the team for the current state
+
+        With LAZY_OBSERVATION, it is a LazyObservation computed on access.
+        The handle keeps a snapshot of the units and the vision of the step,
+        so it holds the state of its own step when it is accessed after the
+        environment moved on, without being computed before.
+        """
+        observe = lambda: self.get_obs_blue if team == TEAM1_BACKGROUND else self.get_obs_red
+        if not self.LAZY_OBSERVATION:
+            return observe()
+
+        state_id, snapshot = self._state_id, self._unit_snapshot()
+        masks, sources = self._masks, self._mask_sources
+        def compute():
+            if self._state_id == state_id:
+                return observe()
+            mask = masks.get(team)
+            if mask is None and sources[team] is not None:
+                mask = self._vision_mask(sources[team], snapshot[0].shape[:2])
+            return self._team_view(team, self._restore_env(snapshot), mask)
+        return LazyObservation(compute, self._env.shape, self._env.dtype)
+
+    @staticmethod
+    def _observation_type(policy):
+        """ Observation declared by the policy, OBS_PARTIAL if it declares none """
+        return getattr(policy, 'observation_type', OBS_PARTIAL)
+
+    def _policy_observation(self, team, kind):
+        """
+        Observation of the team in the form consumed by its policy
 
+        Only the declared form is computed, e.g. a policy with OBS_NONE
+        does not need the vision masks of the team.
 
-        # TODO need to be added observation for grey team
-        # self.observation_space_grey = np.full_like(self._env, -1)
+        Parameters
+        ----------
+        team    : int
+            TEAM1_BACKGROUND or TEAM2_BACKGROUND
+        kind    : str
+            OBS_NONE, OBS_STATIC, OBS_FULL, OBS_PARTIAL or OBS_EGOCENTRIC
+        """
+        if kind == OBS_PARTIAL:
+            return self._lazy_obs(team)
+        if kind == OBS_NONE:
+            return None
+        if kind == OBS_STATIC:
+            return self._map_index.static_map
+        if kind == OBS_FULL:
+            return self._step_full_state()
+        if kind == OBS_EGOCENTRIC:
+            units = self._team_blue if team == TEAM1_BACKGROUND else self._team_red
+            return [agent.get_obs(self) for agent in units]
+        raise ValueError('Unknown observation type {}'.format(kind))
+
+    def _lazy_action_mask(self):
+        """ get_action_mask of the current state, lazy as _lazy_obs """
+        if not self.LAZY_OBSERVATION:
+            return self.get_action_mask
+
+        state_id, snapshot = self._state_id, self._unit_snapshot()
+        teams = [TEAM1_BACKGROUND, TEAM2_BACKGROUND] if self.CONTROL_ALL else [TEAM1_BACKGROUND]
+        def compute():
+            if self._state_id == state_id:
+                return self.get_action_mask
+            env, states = self._restore_env(snapshot), snapshot[1]
+            return np.concatenate([self._valid_actions(states[team], env) for team in teams])
+        num_units = sum(len(snapshot[1][team]) for team in teams)
+        return LazyObservation(compute, (num_units, len(self.ACTION)), bool)
+
+    def _entity_index(self, team, view=None):
+        """
+        Index of the entities visible to the team for the current step
 
+        The view is the team's observation (get_obs_blue or get_obs_red),
+        which is built if it is not given.
+        """
+        index = self._entity_indices.get(team)
+        if index is not None:
+            return index
+
+        if team == TEAM1_BACKGROUND:
+            mask = self._blue_mask
+            view = self.get_obs_blue if view is None else view
+        else:
+            mask = self._red_mask
+            view = self.get_obs_red if view is None else view
+        dead = [agent.get_loc() for agent in self._team_blue + self._team_red
+                if not agent.isAlive and not mask[agent.get_loc()]]
+        index = EntityIndex(view, dead)
+        self._entity_indices[team] = index
+        return index
+
+    def _action_mask(self, team):
+        """
+        Valid actions of the team's units for the current state
+
+        An action is valid if it changes the position of the unit, as in
+        `Agent.move`: the move is clamped to the board, and a ground unit
+        cannot enter an OBSTACLE or a cell occupied by a UGV. Occupancy is
+        taken before any unit moves, so a cell freed by a unit earlier in
+        the list still counts as occupied. The stay action (0) is always
+        valid, and it is the only valid action of a dead unit.
+
+        Return
+        ______
+        mask    : ndarray
+            (n_units, 5) boolean array, read-only
+        """
+        mask = self._action_masks.get(team)
+        if mask is not None:
+            return mask
+
+        mask = self._valid_actions(self._agent_states(team), self._env)
+        self._action_masks[team] = mask
+        return mask
+
+    @staticmethod
+    def _valid_actions(states, env):
+        """
+        Action mask (see _action_mask) of the units with the _agent_states
+        in the environment env
+        """
+        pos = states[:, [STATE_X, STATE_Y]]
+        air = states[:, STATE_AIR].astype(bool)
+        alive = states[:, STATE_ALIVE].astype(bool)
+        step = np.where(air, UAV_STEP, UGV_STEP)
+
+        h, w = env.shape[:2]
+        target = pos[:, None, :] + step[:, None, None] * np.array(ACTION_DELTA)[None, :, :]
+        target[..., 0] = np.clip(target[..., 0], 0, h-1)
+        target[..., 1] = np.clip(target[..., 1], 0, w-1)
+        moved = (target != pos[:, None, :]).any(axis=2)
+        blocked = (env[:, :, CHANNEL[TEAM1_UGV]] != 0) | (env[:, :, CHANNEL[OBSTACLE]] != 0)
+        blocked = blocked[target[..., 0], target[..., 1]]
+
+        mask = moved & (air[:, None] | ~blocked) & alive[:, None]
+        mask[:, 0] = True
+        mask.setflags(write=False)
+        return mask
+
+    def _create_observation_mask(self):
+        """
+        Record the vision of each team for the observation masks
+
+        Mask is True(1) for the location where it CANNOT see.
+        For full observation setting, mask is zero matrix.
+
+        The masks are only built when they are used (see
+        _observation_mask), from the units alive at this point.
+
+        Parameters
+        ----------
+        self    : object
+            CapEnv object
+        """
+        self._masks = {}
+        self._mask_sources = {}
+        for team, units, partial in [(TEAM1_BACKGROUND, self._team_blue, self.BLUE_PARTIAL),
+                                     (TEAM2_BACKGROUND, self._team_red, self.RED_PARTIAL)]:
+            if partial:
+                self._mask_sources[team] = [(agent.get_loc(), agent.range) for agent in units if agent.isAlive]
+            else:
+                self._mask_sources[team] = None
+
+    def _observation_mask(self, team):
+        """ Mask of the cells the team cannot see, built once per step """
+        mask = self._masks.get(team)
+        if mask is not None:
+            return mask
+
+        sources = self._mask_sources[team]
+        if sources is None:
+            mask = np.zeros(self._static_map.shape, dtype=bool)
+        else:
+            mask = self._vision_mask(sources, self._static_map.shape)
+        self._masks[team] = mask
+        return mask
+
+    @staticmethod
+    def _vision_mask(sources, shape):
+        """ Cells outside of the vision of the (center, radius) sources """
+        h, w = shape
+        mask = np.zeros([h, w], dtype=bool)
+        Y, X = np.ogrid[:h, :w]
+        for center, radius in sources:
+            mask += np.sqrt((X - center[1])**2 + (Y-center[0])**2) <= radius
+        return ~mask
+
+    @property
+    def _blue_mask(self):
+        return self._observation_mask(TEAM1_BACKGROUND)
+
+    @property
+    def _red_mask(self):
+        return self._observation_mask(TEAM2_BACKGROUND)
 
     def step(self, entities_action=None, cur_suggestions=None):
         """
@@ -314,8 +623,8 @@ class CapEnv(gym.Env):
             entities_action: contains actions for entity 1-n
             cur_suggestions: suggestions from rl to human
         :return:
-            state    : object
-            CapEnv object
+            state    : ndarray
+            observation of blue team (LazyObservation computed on access with LAZY_OBSERVATION)
             reward  : float
             float containing the reward for the given action
             isDone  : bool
@@ -323,7 +632,7 @@ class CapEnv(gym.Env):
             info    :
         """
 
-        indiv_action_space = len(self.ACTION)
+        num_blue = self.NUM_BLUE + self.NUM_UAV
 
         if self.CONTROL_ALL:
             assert entities_action is not None, 'Under CONTROL_ALL setting, action must be specified'
@@ -332,14 +641,15 @@ class CapEnv(gym.Env):
             assert len(entities_action) == self.NUM_BLUE+self.NUM_RED+self.NUM_UAV+self.NUM_UAV, \
                     'You entered wrong number of moves.'
 
-            move_list_blue = entities_action[:self.NUM_UAV+self.NUM_BLUE]
-            move_list_red  = entities_action[-self.NUM_UAV-self.NUM_RED:]
+            entities_action = np.asarray(entities_action, dtype=int).tolist()
+            move_list_blue = entities_action[:num_blue]
+            move_list_red  = entities_action[num_blue:]
         else:
             # Get actions from uploaded policies
             move_list_red = []
             if self.mode != "sandbox":
                 try:
-                    move_list_red = self._policy_red.gen_action(self._team_red, self.get_obs_red)
+                    move_list_red = self._policy_actions(TEAM2_BACKGROUND)
                 except Exception as e:
                     print("No valid policy for red team", e)
                     traceback.print_exc()
@@ -348,41 +658,101 @@ class CapEnv(gym.Env):
             move_list_blue = []
             if entities_action is None:
                 try:
-                    move_list_blue = self._policy_blue.gen_action(self._team_blue, self.get_obs_blue)
+                    move_list_blue = self._policy_actions(TEAM1_BACKGROUND)
                 except Exception as e:
                     print("No valid policy for blue team and no actions provided", e)
                     traceback.print_exc()
                     exit()
-            elif type(entities_action) is int:
-                if entities_action >= len(self.ACTION) ** (self.NUM_BLUE + self.NUM_UAV):
-                    sys.exit("ERROR: You entered too many moves. There are " + str(self.NUM_BLUE + self.NUM_UAV) + " entities.")
-                while len(move_list_blue) < (self.NUM_BLUE + self.NUM_UAV):
-                    move_list_blue.append(entities_action % indiv_action_space)
-                    entities_action = int(entities_action / indiv_action_space)
+            elif isinstance(entities_action, (int, np.integer)):
+                if entities_action >= len(self.ACTION) ** num_blue:
+                    sys.exit("ERROR: You entered too many moves. There are " + str(num_blue) + " entities.")
+                move_list_blue = self._decode_action(entities_action, num_blue)
             else:
-                if len(entities_action) != self.NUM_BLUE + self.NUM_UAV:
-                    sys.exit("ERROR: You entered wrong number of moves. There are " + str(self.NUM_BLUE + self.NUM_UAV) + " entities.")
-                move_list_blue = entities_action
-
-
-        # Move team1
-        positions = []
-        for idx, act in enumerate(move_list_blue):
-            if self.STOCH_TRANSITIONS and self.np_random.rand() < self.STOCH_TRANSITIONS_EPS:
-                act = self.np_random.randint(0,len(self.ACTION))
-            self._team_blue[idx].move(self.ACTION[act], self._env, self._static_map)
-            positions.append((self._team_blue[idx].get_loc(), self._team_blue[idx].isAlive))
-        self._blue_trajectory.append(positions)
-
-        # Move team2
-        positions = []
-        for idx, act in enumerate(move_list_red):
-            if self.STOCH_TRANSITIONS and self.np_random.rand() < self.STOCH_TRANSITIONS_EPS:
-                act = self.np_random.randint(0,len(self.ACTION))
-            self._team_red[idx].move(self.ACTION[act], self._env, self._static_map)
-            positions.append((self._team_red[idx].get_loc(), self._team_red[idx].isAlive))
-        self._red_trajectory.append(positions)
+                if len(entities_action) != num_blue:
+                    sys.exit("ERROR: You entered wrong number of moves. There are " + str(num_blue) + " entities.")
+                move_list_blue = np.asarray(entities_action, dtype=int).tolist()
+
+
+        scripted = not self.CONTROL_ALL and entities_action is None
+        self._advance(move_list_blue, move_list_red, scripted=scripted)
+
+        # Calculate Reward
+        reward = self._create_reward()
+
+        isDone = self.red_win or self.blue_win or self.stalemate
 
+        # Pass internal info
+        info = {
+                'blue_trajectory': self._blue_trajectory,
+                'red_trajectory': self._red_trajectory,
+                'static_map': self._static_map,
+                'action_mask': self._lazy_action_mask(),
+                'end_reason': self._end_reason()
+            }
+
+        self.run_step += 1
+        
+        return self._lazy_obs(TEAM1_BACKGROUND), reward, isDone, info
+
+    def _decode_action(self, action, num_units):
+        """
+        Actions of the units from a Discrete action
+
+        The action is read in base len(ACTION), the first unit in the lowest
+        digit. The digits are Python integers, since the action does not fit
+        in int64 beyond 27 units.
+        """
+        base = len(self.ACTION)
+        digits = base ** np.arange(num_units).astype(object)
+        return ((int(action) // digits) % base).astype(int).tolist()
+
+    def _policy_actions(self, team):
+        """ Actions of the team's policy, given the observation it declares """
+        if team == TEAM1_BACKGROUND:
+            policy, units = self._policy_blue, self._team_blue
+        else:
+            policy, units = self._policy_red, self._team_red
+        kind = self._observation_type(policy)
+        obs = self._policy_observation(team, kind)  # not computed unless the policy uses or keeps it
+        if kind == OBS_PARTIAL:
+            policy.entities = self._entity_index(team, obs)
+        actions = policy.gen_action(units, obs)
+        policy.entities = None
+        return actions
+
+    def _advance(self, move_list_blue, move_list_red, record=True, scripted=False):
+        """
+        Move the units and resolve the step: memories, interactions and
+        the win conditions
+
+        Parameters
+        ----------
+        move_list_blue  : list
+            actions of blue units
+        move_list_red   : list
+            actions of red units
+        record          : bool
+            append the positions to the trajectories
+        scripted        : bool
+            the actions of both teams come from their policies
+        """
+        # Move team1 and team2, in order
+        units = [self._team_blue[idx] for idx in range(len(move_list_blue))] + \
+                [self._team_red[idx] for idx in range(len(move_list_red))]
+        actions = np.array(list(move_list_blue) + list(move_list_red), dtype=int)
+        if self.STOCH_TRANSITIONS and len(units) > 0:
+            # One draw for the team: below EPS, the draw also picks the random action
+            draw = self.np_random.rand(len(units))
+            random_move = draw < self.STOCH_TRANSITIONS_EPS
+            actions[random_move] = (draw[random_move] / self.STOCH_TRANSITIONS_EPS * len(self.ACTION)).astype(int)
+        move_units(units, actions, self._env, self._static_map)
+
+        if record:
+            num_moved = len(move_list_blue)
+            self._blue_trajectory.append([(agent.get_loc(), agent.isAlive) for agent in units[:num_moved]])
+            self._red_trajectory.append([(agent.get_loc(), agent.isAlive) for agent in units[num_moved:]])
+
+        self._clear_step_cache()
         self._create_observation_mask()
         
         # Update individual's memory
@@ -402,8 +772,10 @@ class CapEnv(gym.Env):
                 survive_list.append(False)
             else:
                 survive_list.append(self._interaction(entity))
-        for status, entity in zip(survive_list, self._team_blue+self._team_red):
-            entity.isAlive = status
+        if any(status != entity.isAlive for status, entity in zip(survive_list, self._team_blue+self._team_red)):
+            for status, entity in zip(survive_list, self._team_blue+self._team_red):
+                entity.isAlive = status
+            self._clear_step_cache()
 
         # Check win and lose conditions
         has_alive_entity = False
@@ -433,21 +805,148 @@ class CapEnv(gym.Env):
             self.red_win = True
             self.blue_eliminated = True
 
-        # Calculate Reward
-        reward = self._create_reward()
+        if self.STALEMATE_STEPS > 0 and not (self.blue_win or self.red_win):
+            self._check_stalemate(scripted)
 
-        isDone = self.red_win or self.blue_win
+    def _unit_positions(self):
+        return [(agent.x, agent.y, agent.isAlive) for agent in self._team_blue + self._team_red]
 
-        # Pass internal info
-        info = {
-                'blue_trajectory': self._blue_trajectory,
-                'red_trajectory': self._red_trajectory,
-                'static_map': self._static_map
-            }
+    def _check_stalemate(self, scripted):
+        """
+        Stalemate detection
 
-        self.run_step += 1
-        
-        return self.get_obs_blue, reward, isDone, info
+        The episode is a stalemate when no ground unit can reach a cell where
+        it could capture the flag or be killed (see `_contact_possible`), or
+        when no unit moved or died for STALEMATE_STEPS steps. The second case
+        only counts the steps whose actions came from policies which declare
+        `deterministic`, since random or external actions can move the units
+        again later. The detection is off with STOCH_TRANSITIONS or
+        STOCH_ATTACK, where a still state can still change.
+
+        Parameters
+        ----------
+        scripted    : bool
+            the actions of both teams come from their policies
+        """
+        if self.STOCH_TRANSITIONS or self.STOCH_ATTACK:
+            return
+
+        positions = self._unit_positions()
+        if positions != self._last_positions:
+            if [alive for _, _, alive in positions] != [alive for _, _, alive in self._last_positions]:
+                self._contact = None
+            self._still_steps = 0
+            self._last_positions = positions
+        elif scripted and self._deterministic_policies():
+            self._still_steps += 1
+        else:
+            self._still_steps = 0
+
+        # Reachability only changes when units die
+        if self._contact is None:
+            self._contact = self._contact_possible()
+        if not self._contact or self._still_steps >= self.STALEMATE_STEPS:
+            self.stalemate = True
+
+    def _deterministic_policies(self):
+        """ True if the policies of both teams declare `deterministic` """
+        red = self.mode == "sandbox" or getattr(self._policy_red, 'deterministic', False)
+        return red and getattr(self._policy_blue, 'deterministic', False)
+
+    def _contact_possible(self):
+        """
+        Check if a team can still win, without stochastic attacks
+
+        A ground unit moves within its component of the free cells. It can
+        capture the flag if the enemy flag is in its component, and it can
+        only be killed outside of its territory, by an enemy ground unit
+        whose component comes within the attack range.
+
+        Return
+        ______
+        bool    :
+            False if no flag can be captured and no unit can be killed
+        """
+        labels = self._map_index.free_labels
+        teams = {TEAM1_BACKGROUND: self._team_blue, TEAM2_BACKGROUND: self._team_red}
+        ground = {team: [agent for agent in units if agent.isAlive and not agent.air]
+                  for team, units in teams.items()}
+
+        # Cells within the attack range of where the units of the team can go
+        reach = {}
+        for team, units in ground.items():
+            reach[team] = np.zeros(self.map_size, dtype=bool)
+            for label, a_range in {(labels[agent.get_loc()], agent.a_range) for agent in units}:
+                reach[team] |= dilate_disk(labels == label, a_range)
+
+        for team, enemy in [(TEAM1_BACKGROUND, TEAM2_BACKGROUND), (TEAM2_BACKGROUND, TEAM1_BACKGROUND)]:
+            flag = self._map_index.enemy_flag(team)
+            for agent in ground[team]:
+                if flag is not None and self._map_index.connected(agent.get_loc(), flag):
+                    return True
+                area = (labels == labels[agent.get_loc()]) & (self._static_map != team)
+                if (area & reach[enemy]).any():
+                    return True
+        return False
+
+    def _end_reason(self):
+        """ Reason of the end of the episode (const.END_*), None if it is not done """
+        if self.blue_flag_captured or self.red_flag_captured:
+            return END_FLAG
+        if self.blue_win or self.red_win:
+            return END_ELIMINATED
+        if self.stalemate:
+            return END_STALEMATE
+        return None
+
+    def rollout(self, max_steps=150, n_episodes=1, custom_board=None, mode="random"):
+        """
+        Play whole episodes with the policies of both teams
+
+        Each episode is reset (with the current settings) and played until
+        a team wins, a stalemate (STALEMATE_STEPS) or max_steps. Both teams
+        are played by their policies, so CONTROL_ALL is not supported. The observations, rewards, info and
+        trajectories of the steps are not built; the policies only get the
+        observation they declare.
+
+        Parameters
+        ----------
+        max_steps   : int
+            maximum number of steps of an episode
+        n_episodes  : int
+            number of episodes
+        custom_board : str, ndarray or list
+            board of the episodes, or a list of boards to pick from at
+            random (with the environment's seed) for each episode (optional)
+        mode        : str
+            action generation mode given to reset
+
+        Return
+        ______
+        records     : ndarray
+            (n_episodes,) structured array of ROLLOUT_DTYPE
+        """
+        if self.CONTROL_ALL:
+            raise ValueError('rollout plays the policies of both teams, it cannot run under CONTROL_ALL')
+        records = np.zeros(n_episodes, dtype=ROLLOUT_DTYPE)
+        for record in records:
+            board = custom_board
+            if isinstance(custom_board, list):
+                board = custom_board[self.np_random.randint(len(custom_board))]
+            self.reset(mode=mode, custom_board=board)
+            for _ in range(max_steps):
+                move_list_red = self._policy_actions(TEAM2_BACKGROUND) if self.mode != "sandbox" else []
+                self._advance(self._policy_actions(TEAM1_BACKGROUND), move_list_red, record=False, scripted=True)
+                self.run_step += 1
+                if self.blue_win or self.red_win or self.stalemate:
+                    break
+            record['steps'] = self.run_step
+            for field in ['blue_win', 'red_win', 'blue_flag_captured', 'red_flag_captured',
+                          'blue_eliminated', 'red_eliminated', 'stalemate']:
+                record[field] = getattr(self, field)
+            record['blue_alive'] = sum(agent.isAlive for agent in self._team_blue)
+            record['red_alive'] = sum(agent.isAlive for agent in self._team_red)
+        return records
 
     def _interaction(self, entity):
         """
@@ -538,32 +1037,20 @@ class CapEnv(gym.Env):
     def _update_global_memory(self, env):
         """ 
         team memory map
-        
+
+        The memory is updated with the cells seen by any member of the team,
+        using the vision cached for the step. The last-seen memory records
+        the step number and the full state of the same cells.
         """
         
-        l, b = self.blue_memory.shape
-        for blue_agent in self._team_blue:
-            b_obs = blue_agent.get_obs(env=env)
-            leng, breth = b_obs.shape
-            leng, breth = leng//2, breth//2
-            b_coord_x, b_coord_y = blue_agent.get_loc()
-            b_offset_x, b_offset_y = leng - b_coord_x, breth - b_coord_y
-            b_obs = b_obs[b_offset_x: b_offset_x + l, b_offset_y: b_offset_y + b]   
-            b_coord = b_obs!= const.UNKNOWN
-            self.blue_memory[b_coord] = self._static_map[b_coord]
-             
-        l, b = self.red_memory.shape
-        for red_agent in self._team_red:
-            r_obs = red_agent.get_obs(env=env)
-            leng, breth = r_obs.shape
-            leng, breth = leng//2, breth//2
-            r_coord_x, r_coord_y = red_agent.get_loc()
-            r_offset_x, r_offset_y = leng - r_coord_x, breth - r_coord_y
-            r_obs = r_obs[r_offset_x: r_offset_x + l, r_offset_y: r_offset_y + b]   
-            r_coord = r_obs!= const.UNKNOWN
-            self.red_memory[r_coord] = self._static_map[r_coord]
-        
-        return
+        state = self._step_full_state()
+        for team, memory, team_memory in ((self._team_blue, self.blue_memory, self._team_memory_blue),
+                                        (self._team_red, self.red_memory, self._team_memory_red)):
+            seen = np.zeros(memory.shape, dtype=bool)
+            for agent in team:
+                seen |= agent.get_vision(env=env)
+            np.copyto(memory, self._static_map, where=seen)
+            team_memory.update(seen, state, self.run_step + 1)
 
     def _create_reward(self, mode='dense'):
         """
@@ -644,27 +1131,23 @@ class CapEnv(gym.Env):
             # ind blue agent memory rendering
             for num_blue, blue_agent in enumerate(self._team_blue):
                 if num_blue < 2:
-                    blue_agent.INDIV_MEMORY = self.INDIV_MEMORY
-                    if blue_agent.INDIV_MEMORY == "fog" and self.RENDER_INDIV_MEMORY == True:
+                    if self.INDIV_MEMORY == "fog" and self.RENDER_INDIV_MEMORY == True:
                         self._env_render(blue_agent.memory,
                                          [900+num_blue*SCREEN_H//4, 7], [SCREEN_H//4-10, SCREEN_H//4-10])
                 else:
-                    blue_agent.INDIV_MEMORY = self.INDIV_MEMORY
-                    if blue_agent.INDIV_MEMORY == "fog" and self.RENDER_INDIV_MEMORY == True:
+                    if self.INDIV_MEMORY == "fog" and self.RENDER_INDIV_MEMORY == True:
                         self._env_render(blue_agent.memory,
                                          [900+(num_blue-2)*SCREEN_H//4, 7+SCREEN_H//4], [SCREEN_H//4-10, SCREEN_H//4-10])
 
             # ind red agent memory rendering
             for num_red, red_agent in enumerate(self._team_red):
                 if num_red < 2:
-                    red_agent.INDIV_MEMORY = self.INDIV_MEMORY
-                    if red_agent.INDIV_MEMORY == "fog" and self.RENDER_INDIV_MEMORY == True:
+                    if self.INDIV_MEMORY == "fog" and self.RENDER_INDIV_MEMORY == True:
                         self._env_render(red_agent.memory,
                                          [900+num_red*SCREEN_H//4, 7+1.49*SCREEN_H//2], [SCREEN_H//4-10, SCREEN_H//4-10])
     
                 else:
-                    red_agent.INDIV_MEMORY = self.INDIV_MEMORY
-                    if red_agent.INDIV_MEMORY == "fog" and self.RENDER_INDIV_MEMORY == True:
+                    if self.INDIV_MEMORY == "fog" and self.RENDER_INDIV_MEMORY == True:
                         self._env_render(red_agent.memory,
                                          [900+(num_red-2)*SCREEN_H//4, 7+SCREEN_H//2], [SCREEN_H//4-10, SCREEN_H//4-10])
 
@@ -768,27 +1251,25 @@ class CapEnv(gym.Env):
         if self.viewer: self.viewer.close()
 
     def _env_flat(self, mask=None):
-        # Return 2D representation of the state
+        """
+        Return 2D representation of the state
+
+        Alive units are written over the static map in the order of
+        _team_blue + _team_red, so the later unit is shown when a UAV and a
+        UGV share a cell. Cells under the mask are UNKNOWN.
+        """
         board = np.copy(self._static_map)
+        for unit in self._team_blue + self._team_red:
+            if unit.isAlive:
+                board[unit.x, unit.y] = _UNIT_CODE[unit.team][unit.air]
         if mask is not None:
             board[mask] = UNKNOWN
-        for entities in self._team_blue+self._team_red:
-            if not entities.isAlive: continue
-            loc = entities.get_loc()
-            if mask is not None and mask[loc]: continue
-            if entities.team == TEAM1_BACKGROUND and entities.air:
-                board[loc] = TEAM1_UAV
-            elif entities.team == TEAM1_BACKGROUND and not entities.air:
-                board[loc] = TEAM1_UGV
-            elif entities.team == TEAM2_BACKGROUND and entities.air:
-                board[loc] = TEAM2_UAV
-            elif entities.team == TEAM2_BACKGROUND and not entities.air:
-                board[loc] = TEAM2_UGV
         return board
 
     @property
-    def get_full_state(self, mask=None):
-        return self._env_flat()
+    def get_full_state(self):
+        """ Flat state of the current step, computed once per step and read-only """
+        return self._step_full_state()
 
     @property
     def get_full_state_channel(self):
@@ -796,21 +1277,17 @@ class CapEnv(gym.Env):
 
     @property
     def get_full_state_rgb(self):
-        w, h, ch = self._env.shape
-        image = np.full(shape=[w, h, 3], fill_value=0, dtype=int)
-        for element in CHANNEL.keys():
-            channel = CHANNEL[element]
-            rep = REPRESENT[element]
-            image[self._env[:,:,channel]==rep] = np.array(COLOR_DICT[element])
-        return image
+        return ELEMENT_COLOR[CreateMap.channel_to_flat(self._env)]
 
     @property
     def get_team_blue(self):
-        return np.copy(self._team_blue)
+        """ Units of blue team, as a tuple built once per reset """
+        return self._team_blue_view
 
     @property
     def get_team_red(self):
-        return np.copy(self._team_red)
+        """ Units of red team, as a tuple built once per reset """
+        return self._team_red_view
 
     @property
     def get_team_grey(self):
@@ -822,43 +1299,116 @@ class CapEnv(gym.Env):
 
     @property
     def get_obs_blue(self):
-        blue_view = np.copy(self._env)
+        return self._team_view(TEAM1_BACKGROUND, self._env, self._blue_mask if self.BLUE_PARTIAL else None)
 
-        if self.BLUE_PARTIAL:
-            mask_channel = CHANNEL[UNKNOWN]
-            mask_represent = REPRESENT[UNKNOWN]
+    @property
+    def get_obs_red(self):
+        return self._team_view(TEAM2_BACKGROUND, self._env, self._red_mask if self.RED_PARTIAL else None)
+
+    @staticmethod
+    def _team_view(team, env, mask=None):
+        """ View of env in the perspective of the team, UNKNOWN under the mask """
+        if team == TEAM1_BACKGROUND:
+            view = np.copy(env)
+        else:
+            # Change red's perspective same as blue
+            view = env * _PERSPECTIVE[TEAM2_BACKGROUND]
 
-            blue_view[self._blue_mask, :] = 0
-            blue_view[self._blue_mask, mask_channel] = mask_represent
+        if mask is not None:
+            np.copyto(view, _UNKNOWN_CELL, where=mask[:, :, None])
 
-        return blue_view
+        return view
 
     @property
-    def get_obs_red(self):
-        red_view = np.copy(self._env)
+    def get_obs_teams(self):
+        """ Observations of both teams, (2, h, w, NUM_CHANNEL) """
+        return self._obs_teams()
+
+    def _obs_teams(self, out=None):
+        """
+        Observations of both teams in one array
+
+        Index TEAM1_BACKGROUND is get_obs_blue and TEAM2_BACKGROUND is
+        get_obs_red. The red perspective is written with the sign vector of
+        the channels, so both views are produced in the same pass.
 
+        Parameters
+        ----------
+        out     : ndarray
+            (2, h, w, NUM_CHANNEL) array to write the views into (optional)
+        """
+        if out is None:
+            out = np.empty((2,) + self._env.shape, dtype=self._env.dtype)
+        np.copyto(out[TEAM1_BACKGROUND], self._env)
+        np.multiply(self._env, _PERSPECTIVE[TEAM2_BACKGROUND], out=out[TEAM2_BACKGROUND])
+
+        if self.BLUE_PARTIAL:
+            np.copyto(out[TEAM1_BACKGROUND], _UNKNOWN_CELL, where=self._blue_mask[:, :, None])
         if self.RED_PARTIAL:
-            mask_represent = REPRESENT[UNKNOWN]
-            mask_channel = CHANNEL[UNKNOWN]
+            np.copyto(out[TEAM2_BACKGROUND], _UNKNOWN_CELL, where=self._red_mask[:, :, None])
 
-            red_view[self._red_mask, :] = 0
-            red_view[self._red_mask, mask_channel] = mask_represent
+        return out
 
-        # Change red's perspective same as blue
-        swap = [CHANNEL[TEAM1_BACKGROUND], CHANNEL[TEAM1_UGV], CHANNEL[TEAM1_UAV], CHANNEL[TEAM1_FLAG]]
+    @property
+    def get_threat_blue(self):
+        return self._threat_map(TEAM1_BACKGROUND)
+
+    @property
+    def get_threat_red(self):
+        return self._threat_map(TEAM2_BACKGROUND)
+
+    @property
+    def get_action_mask_blue(self):
+        return self._action_mask(TEAM1_BACKGROUND)
+
+    @property
+    def get_action_mask_red(self):
+        return self._action_mask(TEAM2_BACKGROUND)
+
+    @property
+    def get_action_mask(self):
+        """ Valid actions of the controlled units, in the order of step(action) """
+        if self.CONTROL_ALL:
+            return np.concatenate([self.get_action_mask_blue, self.get_action_mask_red])
+        return self.get_action_mask_blue
+
+    @property
+    def get_agent_states_blue(self):
+        return self._agent_states(TEAM1_BACKGROUND)
+
+    @property
+    def get_agent_states_red(self):
+        return self._agent_states(TEAM2_BACKGROUND)
 
-        for ch in swap:
-            red_view[:,:,ch] *= -1
+    @property
+    def get_map_index(self):
+        return self._map_index
+
+    @property
+    def get_entities_blue(self):
+        return self._entity_index(TEAM1_BACKGROUND)
 
-        return red_view
+    @property
+    def get_entities_red(self):
+        return self._entity_index(TEAM2_BACKGROUND)
+
+    @property
+    def get_team_memory_blue(self):
+        """ Last-seen memory of blue team (only with TEAM_MEMORY="fog", None otherwise) """
+        return self._team_memory_blue
+
+    @property
+    def get_team_memory_red(self):
+        """ Last-seen memory of red team (only with TEAM_MEMORY="fog", None otherwise) """
+        return self._team_memory_red
 
     @property
     def get_obs_blue_render(self):
-        return self._env_flat(self._blue_mask)
+        return np.where(self._blue_mask, UNKNOWN, self._step_full_state())
 
     @property
     def get_obs_red_render(self):
-        return self._env_flat(self._red_mask)
+        return np.where(self._red_mask, UNKNOWN, self._step_full_state())
 
     @property
     def get_obs_grey(self):
@@ -0,0 +1,127 @@
+import numpy as np
+
+from .agent import stamp_disk
+
+class CommunicationGraph:
+    """
+    Communication graph of a team for one step
+
+    Units which are allowed to transmit (ground units under COM_GROUND, aerial
+    units under COM_AIR) are linked if they are within COM_DISTANCE. A unit
+    receives the vision of every transmitting unit linked to it, and with
+    COM_MULTIHOP, of every unit relayed through the connected component.
+
+    Shared vision is kept in padded coordinates: the cell (i, j) of the map is
+    at (i+h-1, j+w-1). The egocentric window of a unit at (x, y) is then the
+    slice [x:x+2h-1, y:y+2w-1] of the padded array.
+    """
+
+    def __init__(self, team, map_size, com_ground, com_air, distance=-1,
+                 multihop=False, frequency=None, np_random=None):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        team        : list
+            list of Agent objects of the team
+        map_size    : tuple
+            (h, w) size of the map
+        com_ground  : bool
+            ground units transmit
+        com_air     : bool
+            aerial units transmit
+        distance    : int
+            maximum distance of a link, -1 for infinite distance
+        multihop    : bool
+            relay the vision through the connected components
+        frequency   : float
+            probability that the shared cell goes through
+        np_random   : RandomState
+            random generator for the dropout
+        """
+        self.team = team
+        self.map_size = map_size
+        self.frequency = frequency
+        self.np_random = np.random if np_random is None else np_random
+
+        n = len(team)
+        self.index = {id(agent): idx for idx, agent in enumerate(team)}
+        self.positions = np.array([agent.get_loc() for agent in team], dtype=int).reshape(n, 2)
+        alive = np.array([agent.isAlive for agent in team], dtype=bool)
+        air = np.array([agent.air for agent in team], dtype=bool)
+        self.transmit = alive & np.where(air, com_air, com_ground)
+
+        # Pairwise links
+        if distance == -1:
+            link = np.ones((n, n), dtype=bool)
+        else:
+            diff = self.positions[:, None, :] - self.positions[None, :, :]
+            link = np.hypot(diff[..., 0], diff[..., 1]) <= distance
+
+        # Units heard by each unit
+        receive = link & self.transmit[None, :]
+        if multihop:
+            labels = self._components(link & self.transmit[:, None] & self.transmit[None, :])
+            same = (labels[:, None] == labels[None, :]) & self.transmit[None, :]
+            receive = (receive.astype(int) @ same.astype(int)) > 0
+        self.receive = receive & alive[:, None]
+
+        self._shared = {}
+        self._received = None
+
+    @staticmethod
+    def _components(adjacency):
+        """Label connected components by propagating the minimum index."""
+        n = len(adjacency)
+        labels = np.arange(n)
+        adjacency = adjacency | np.eye(n, dtype=bool)
+        while True:
+            new_labels = np.where(adjacency, labels[None, :], n).min(axis=1)
+            if np.array_equal(new_labels, labels):
+                return labels
+            labels = new_labels
+
+    def sources(self, agent):
+        """Return the indices of the units the agent receives from."""
+        return tuple(np.flatnonzero(self.receive[self.index[id(agent)]]))
+
+    def shared_vision(self, agent):
+        """
+        Union of the vision disks the agent receives, in padded coordinates
+
+        The union is computed once for each group of sources and shared.
+        """
+        key = self.sources(agent)
+        mask = self._shared.get(key)
+        if mask is None:
+            h, w = self.map_size
+            mask = np.zeros((3*h-2, 3*w-2), dtype=bool)
+            for idx in key:
+                x, y = self.positions[idx]
+                stamp_disk(mask, x+h-1, y+w-1, self.team[idx].range)
+            self._shared[key] = mask
+        return mask
+
+    def received_vision(self, agent):
+        """
+        Shared vision which reaches the agent, in padded coordinates
+
+        Under COM_FREQUENCY < 1, every received cell is lost with probability
+        1-COM_FREQUENCY, independently for each unit. The dropout is only
+        drawn over the cells the units receive, once for the whole team.
+        """
+        if self.frequency is None or self.frequency >= 1.0:
+            return self.shared_vision(agent)
+        if self._received is None:
+            masks = [self.shared_vision(unit) for unit in self.team]
+            counts = [int(np.count_nonzero(mask)) for mask in masks]
+            draws = self.np_random.random_sample(sum(counts)) <= self.frequency
+            self._received = []
+            start = 0
+            for mask, count in zip(masks, counts):
+                received = np.zeros_like(mask)
+                received[mask] = draws[start:start+count]
+                self._received.append(received)
+                start += count
+        return self._received[self.index[id(agent)]]
@@ -1,3 +1,5 @@
+import numpy as np
+
 # TeamConst
 """ Defining the constants for agents and teams """
 RED = 10
@@ -23,12 +25,14 @@ STOCH_ATTACK_BIAS = 1
 STOCH_ZONES = False
 RED_PARTIAL = True
 BLUE_PARTIAL = True
+STALEMATE_STEPS = 0      # End the episode after this many steps without any unit moving or dying, under deterministic policies (0: never)
 
 # Communication Default Setting
 COM_GROUND = False
 COM_AIR = False
 COM_DISTANCE = -1
 COM_FREQUENCY = 1.0
+COM_MULTIHOP = False     # Relay vision through connected units
 
 # Memory Default Setting
 INDIV_MEMORY = None      # ['None', 'fog', 'Full']
@@ -36,8 +40,36 @@ TEAM_MEMORY = None       # ['None', 'fog', 'Full']
 RENDER_INDIV_MEMORY = False
 RENDER_TEAM_MEMORY = False
 
+# Actions
+ACTION_DELTA = [(0, 0), (0, -1), (1, 0), (0, 1), (-1, 0)]  # (dx, dy) of ["X", "N", "E", "S", "W"]
+ACTION_INDEX = {"X": 0, "N": 1, "E": 2, "S": 3, "W": 4}
+
+# Agent state (columns of the stacked states given to batched policies)
+STATE_X, STATE_Y, STATE_TEAM, STATE_ALIVE, STATE_AIR = range(5)
+
+# Observation consumed by a policy (policy.observation_type)
+OBS_NONE = "none"                # observation is not used, None is given
+OBS_STATIC = "static"            # static map
+OBS_FULL = "full"                # flat full state
+OBS_PARTIAL = "partial"          # channel view of the team (default)
+OBS_EGOCENTRIC = "egocentric"    # list of the egocentric observation of each unit
+
+# Reason of the end of an episode (info['end_reason'], None until the episode is done)
+END_FLAG = "flag"                # a flag was captured
+END_ELIMINATED = "eliminated"    # a team has no ground unit alive
+END_STALEMATE = "stalemate"      # no team can win anymore (STALEMATE_STEPS)
+
+# Outcome of an episode of CapEnv.rollout
+ROLLOUT_DTYPE = np.dtype([('steps', np.int32),
+                          ('blue_win', bool), ('red_win', bool),
+                          ('blue_flag_captured', bool), ('red_flag_captured', bool),
+                          ('blue_eliminated', bool), ('red_eliminated', bool), ('stalemate', bool),
+                          ('blue_alive', np.int16), ('red_alive', np.int16)])
+
 # Control Setting (Experiment)
 CONTROL_ALL = False  # If true, step(action) controls both red and blue
+MULTI_DISCRETE = False  # If true, action_space is MultiDiscrete([5]*n) instead of Discrete(5**n)
+LAZY_OBSERVATION = False  # If true, reset and step return LazyObservation handles, computed on access
 NP_SEED = None
 
 # MapConst
@@ -118,3 +150,30 @@ REPRESENT = {
         TEAM2_UAV: -1
     }
 
+# Lookup tables of the elements
+""" Dense tables indexed by the element code, for whole-array conversions.
+Negative codes (e.g. UNKNOWN) wrap to the end of the tables, so a board of
+codes can be used directly as the index, e.g. ELEMENT_COLOR[board]. """
+NUM_ELEMENT = TEAM3_UGV - SUGGESTION + 1
+ELEMENT_CHANNEL = np.full(NUM_ELEMENT, -1, dtype=int)    # -1 if not in the channel representation
+ELEMENT_REPRESENT = np.zeros(NUM_ELEMENT, dtype=int)
+ELEMENT_COLOR = np.zeros((NUM_ELEMENT, 3), dtype=int)
+ELEMENT_TEAM = np.full(NUM_ELEMENT, -1, dtype=int)       # -1 if the element belongs to no team
+for _element, _channel in CHANNEL.items():
+    ELEMENT_CHANNEL[_element] = _channel
+    ELEMENT_REPRESENT[_element] = REPRESENT[_element]
+for _element, _color in COLOR_DICT.items():
+    ELEMENT_COLOR[_element] = _color
+ELEMENT_TEAM[[TEAM1_BACKGROUND, TEAM1_UGV, TEAM1_UAV, TEAM1_FLAG]] = TEAM1_BACKGROUND
+ELEMENT_TEAM[[TEAM2_BACKGROUND, TEAM2_UGV, TEAM2_UAV, TEAM2_FLAG]] = TEAM2_BACKGROUND
+
+# Element of each (channel, represent + 1), BLACK where no element is represented
+CHANNEL_ELEMENT = np.full((NUM_CHANNEL, 3), BLACK, dtype=int)
+for _element, _channel in CHANNEL.items():
+    CHANNEL_ELEMENT[_channel, REPRESENT[_element] + 1] = _element
+
+# Element of the units, indexed by [team, air]
+UNIT_ELEMENT = np.array([[TEAM1_UGV, TEAM1_UAV], [TEAM2_UGV, TEAM2_UAV]])
+
+for _table in [ELEMENT_CHANNEL, ELEMENT_REPRESENT, ELEMENT_COLOR, ELEMENT_TEAM, CHANNEL_ELEMENT, UNIT_ELEMENT]:
+    _table.setflags(write=False)
@@ -134,9 +134,6 @@ class CreateMap:
             
         """
         
-        channel = CHANNEL
-        repr_const = REPRESENT
-        
         # build object count array
         element_count = dict(zip(*np.unique(new_map, return_counts=True)))
         ugv_1 = element_count.get(TEAM1_UGV, 0)
@@ -161,14 +158,11 @@ class CreateMap:
         static_map[team2_uav_loc] = TEAM2_BACKGROUND
         static_map[team3_ugv_loc] = TEAM1_BACKGROUND # subject to change
         
-        # build 3D new_map
-        l, b = new_map.shape
-        nd_map = np.zeros([l, b,NUM_CHANNEL], dtype = int)
-        for elem in channel.keys():
-            ch = channel[elem]
-            const = repr_const[elem]
-            if elem in new_map:
-                nd_map[new_map==elem,ch] = const
+        # build 3D new_map, with the team background under the units
+        nd_map = CreateMap.flat_to_channel(new_map)
+        units = team1_ugv_loc | team1_uav_loc | team2_ugv_loc | team2_uav_loc
+        background = ELEMENT_TEAM[new_map[units]]
+        nd_map[units, ELEMENT_CHANNEL[background]] = ELEMENT_REPRESENT[background]
         
         # location of agents
         agent_locs = {}
@@ -177,13 +171,55 @@ class CreateMap:
         agent_locs[TEAM2_UGV] = np.argwhere(team2_ugv_loc)
         agent_locs[TEAM2_UAV] = np.argwhere(team2_uav_loc)
         
-        nd_map[team1_ugv_loc, CHANNEL[TEAM1_BACKGROUND]] = REPRESENT[TEAM1_BACKGROUND]
-        nd_map[team1_uav_loc, CHANNEL[TEAM1_BACKGROUND]] = REPRESENT[TEAM1_BACKGROUND]
-        nd_map[team2_ugv_loc, CHANNEL[TEAM2_BACKGROUND]] = REPRESENT[TEAM2_BACKGROUND]
-        nd_map[team2_uav_loc, CHANNEL[TEAM2_BACKGROUND]] = REPRESENT[TEAM2_BACKGROUND]
-        
         return nd_map, static_map, obj_arr, agent_locs
 
+    @staticmethod
+    def flat_to_channel(board):
+        """
+        Method
+            Encode a 2d board of elements into the channel representation
+
+        Parameters
+        ----------
+        board       : numpy array
+            2d array of element codes. Elements without a channel
+            (e.g. TEAM3_UGV) are left empty.
+
+        Return
+        ______
+        nd_map      : numpy array
+            (h, w, NUM_CHANNEL) array
+        """
+        board = np.asarray(board)
+        nd_map = np.zeros(board.shape + (NUM_CHANNEL,), dtype=int)
+        rows, cols = np.nonzero(ELEMENT_CHANNEL[board] >= 0)
+        elements = board[rows, cols]
+        nd_map[rows, cols, ELEMENT_CHANNEL[elements]] = ELEMENT_REPRESENT[elements]
+        return nd_map
+
+    @staticmethod
+    def channel_to_flat(nd_map):
+        """
+        Method
+            Decode the channel representation into a 2d board of elements
+
+        The element of the highest non-empty channel is kept for each cell,
+        so units are shown over flags and backgrounds, and UAVs over UGVs.
+
+        Parameters
+        ----------
+        nd_map      : numpy array
+            (h, w, NUM_CHANNEL) array
+
+        Return
+        ______
+        board       : numpy array
+            2d array of element codes
+        """
+        top = NUM_CHANNEL - 1 - np.argmax(nd_map[:, :, ::-1] != 0, axis=2)
+        value = np.take_along_axis(nd_map, top[:, :, None], axis=2)[:, :, 0]
+        return CHANNEL_ELEMENT[top, value + 1]
+
     @staticmethod
     def populate_map(new_map, code_where, code_what, channel, number=1):
         """
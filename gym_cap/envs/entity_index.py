@@ -0,0 +1,69 @@
+import numpy as np
+
+from .const import *
+
+class EntityIndex:
+    """
+    Positions of the entities visible to a team for one step
+
+    The index is built from the team's view (friendly units are +1 and enemy
+    units are -1 in their channel), so TEAM1_* codes are friendly and
+    TEAM2_* codes are enemy for either team. The positions of a code are
+    found on the first query and kept, in the row-major order of np.where.
+    """
+
+    def __init__(self, view, dead=None):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        view    : ndarray
+            (h, w, NUM_CHANNEL) observation of the team
+        dead    : list
+            visible locations of the dead units
+        """
+        self.view = view
+        self._dead = dead if dead is not None else []
+        self._positions = {}
+
+    def positions(self, code):
+        """
+        Return the (n, 2) array of the positions of the code
+
+        Parameters
+        ----------
+        code    : int
+            TEAM1_UGV, TEAM1_UAV, TEAM1_FLAG, TEAM2_UGV, TEAM2_UAV,
+            TEAM2_FLAG or DEAD
+        """
+        pos = self._positions.get(code)
+        if pos is None:
+            if code == DEAD:
+                pos = np.array(sorted(self._dead), dtype=int).reshape(-1, 2)
+            else:
+                pos = np.argwhere(self.view[:, :, CHANNEL[code]] == REPRESENT[code])
+            pos.setflags(write=False)
+            self._positions[code] = pos
+        return pos
+
+    def nearest(self, code, loc):
+        """
+        Return the nearest position of the code from loc, or None
+
+        Ties are broken by the row-major order.
+        """
+        pos = self.positions(code)
+        if len(pos) == 0:
+            return None
+        diff = pos - loc
+        dist = diff[:, 0]**2 + diff[:, 1]**2
+        return tuple(pos[np.argmin(dist)])
+
+    def in_radius(self, code, loc, radius):
+        """
+        Return the positions of the code within the radius from loc
+        """
+        pos = self.positions(code)
+        diff = pos - loc
+        return pos[diff[:, 0]**2 + diff[:, 1]**2 <= radius*radius]
@@ -0,0 +1,158 @@
+import hashlib
+
+import numpy as np
+
+from .const import *
+
+def label_components(mask):
+    """
+    Label the 4-connected components of the mask
+
+    Components are found by hooking the roots of every edge to the smaller
+    root and compressing the trees, on the whole board at once.
+
+    Parameters
+    ----------
+    mask    : ndarray
+        2d boolean array
+
+    Return
+    ______
+    labels  : ndarray
+        component of each cell, numbered from 0 in the row-major order of
+        their first cell. Cells outside of the mask are -1.
+    count   : int
+        number of components
+    """
+    h, w = mask.shape
+    idx = np.arange(h*w).reshape(h, w)
+    horizontal = mask[:, :-1] & mask[:, 1:]
+    vertical = mask[:-1, :] & mask[1:, :]
+    a = np.concatenate([idx[:, :-1][horizontal], idx[:-1, :][vertical]])
+    b = np.concatenate([idx[:, 1:][horizontal], idx[1:, :][vertical]])
+
+    parent = np.arange(h*w)
+    while True:
+        pa, pb = parent[a], parent[b]
+        differ = pa != pb
+        if not differ.any():
+            break
+        np.minimum.at(parent, np.maximum(pa, pb)[differ], np.minimum(pa, pb)[differ])
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+
+    labels = np.full((h, w), -1, dtype=int)
+    roots, labels[mask] = np.unique(parent.reshape(h, w)[mask], return_inverse=True)
+    return labels, len(roots)
+
+
+class MapIndex:
+    """
+    Analysis of a static map, shared by the environment and the policies
+
+    The index is computed once per board and it is read-only. Use
+    `MapIndex.from_map` to reuse the index of a board which was seen
+    before, e.g. when the same custom board is reset many times.
+
+    Attributes
+    ----------
+    static_map  : ndarray
+        2d static map
+    hash        : str
+        digest of the content of the map
+    flags       : dict
+        TEAM1_FLAG and TEAM2_FLAG -> coordinate of the flag, or None
+    zone        : dict
+        TEAM1_BACKGROUND and TEAM2_BACKGROUND -> mask of the territory
+    obstacle    : ndarray
+        mask of the obstacles
+    free        : ndarray
+        mask of the cells which are not obstacle
+    obstacles   : ndarray
+        (n, 2) coordinates of the obstacles, in row-major order
+    border      : dict
+        team -> mask of the team's cells next to the enemy territory
+    border_labels : dict
+        team -> component of each border cell, -1 elsewhere
+    free_labels : ndarray
+        component of each free cell, -1 for obstacles
+    """
+
+    _CACHE = {}
+    CACHE_SIZE = 16
+
+    @classmethod
+    def from_map(cls, static_map):
+        """ Return the index of the map, cached by the content of the map """
+        static_map = np.asarray(static_map)
+        key = cls.digest(static_map)
+        index = cls._CACHE.get(key)
+        if index is None:
+            if len(cls._CACHE) >= cls.CACHE_SIZE:
+                cls._CACHE.pop(next(iter(cls._CACHE)))
+            index = cls(static_map)
+            cls._CACHE[key] = index
+        return index
+
+    @staticmethod
+    def digest(static_map):
+        static_map = np.ascontiguousarray(static_map)
+        content = str(static_map.shape).encode() + static_map.astype(np.int64).tobytes()
+        return hashlib.sha1(content).hexdigest()
+
+    def __init__(self, static_map):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        static_map  : ndarray
+            2d static map of the board
+        """
+        self.static_map = np.array(static_map)
+        self.shape = self.static_map.shape
+        self.hash = self.digest(self.static_map)
+
+        self.flags = {}
+        for flag in [TEAM1_FLAG, TEAM2_FLAG]:
+            loc = np.argwhere(self.static_map == flag)
+            self.flags[flag] = tuple(int(v) for v in loc[0]) if len(loc) else None
+
+        self.zone = {team: self.static_map == team for team in [TEAM1_BACKGROUND, TEAM2_BACKGROUND]}
+        self.obstacle = self.static_map == OBSTACLE
+        self.free = ~self.obstacle
+        self.obstacles = np.argwhere(self.obstacle)
+
+        self.border = {}
+        self.border_labels = {}
+        for team, other in [(TEAM1_BACKGROUND, TEAM2_BACKGROUND), (TEAM2_BACKGROUND, TEAM1_BACKGROUND)]:
+            enemy = self.zone[other]
+            near_enemy = np.zeros(self.shape, dtype=bool)
+            near_enemy[1:, :] |= enemy[:-1, :]
+            near_enemy[:-1, :] |= enemy[1:, :]
+            near_enemy[:, 1:] |= enemy[:, :-1]
+            near_enemy[:, :-1] |= enemy[:, 1:]
+            self.border[team] = self.zone[team] & near_enemy
+            self.border_labels[team], _ = label_components(self.border[team])
+
+        self.free_labels, _ = label_components(self.free)
+
+        for value in [self.static_map, self.obstacle, self.free, self.obstacles,
+                      self.free_labels, *self.zone.values(), *self.border.values(),
+                      *self.border_labels.values()]:
+            value.setflags(write=False)
+
+    def flag(self, team):
+        """ Coordinate of the team's own flag """
+        return self.flags[TEAM1_FLAG if team == TEAM1_BACKGROUND else TEAM2_FLAG]
+
+    def enemy_flag(self, team):
+        """ Coordinate of the enemy flag """
+        return self.flags[TEAM2_FLAG if team == TEAM1_BACKGROUND else TEAM1_FLAG]
+
+    def connected(self, a, b):
+        """ True if a ground unit can travel between the two cells """
+        return self.free_labels[a] >= 0 and self.free_labels[a] == self.free_labels[b]
@@ -0,0 +1,57 @@
+import numpy as np
+
+from .const import UNKNOWN
+
+class TeamMemory:
+    """
+    Last-seen memory of a team
+
+    For every cell of the board, the memory keeps the step when the team
+    last observed the cell and the contents of the full state seen at that
+    time, including the dynamic units (e.g. enemy UGV). Cells which have
+    never been observed have `last_seen` -1 and `last_state` UNKNOWN.
+    """
+
+    def __init__(self, map_size):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        map_size    : tuple
+            (h, w) size of the board
+        """
+        self.map_size = tuple(map_size)
+        self.last_seen = np.full(self.map_size, -1, dtype=np.int32)
+        self.last_state = np.full(self.map_size, UNKNOWN, dtype=np.int8)
+
+    def clear(self):
+        self.last_seen[:] = -1
+        self.last_state[:] = UNKNOWN
+
+    def update(self, vision, state, step):
+        """
+        Record the cells observed at the step
+
+        Parameters
+        ----------
+        vision      : ndarray
+            boolean mask of the cells seen by the team
+        state       : ndarray
+            2d full state of the board
+        step        : int
+            step of the observation
+        """
+        np.copyto(self.last_seen, step, where=vision)
+        np.copyto(self.last_state, state, where=vision, casting='unsafe')
+
+    def age(self, step):
+        """
+        Number of steps since each cell was observed, -1 for never
+        """
+        return np.where(self.last_seen < 0, -1, step - self.last_seen)
+
+    @property
+    def seen(self):
+        """ Boolean mask of the cells observed at least once """
+        return self.last_seen >= 0
@@ -0,0 +1,91 @@
+import numpy as np
+from numpy.lib.mixins import NDArrayOperatorsMixin
+
+class LazyObservation(NDArrayOperatorsMixin):
+    """
+    Observation which is only computed when it is accessed
+
+    The handle is used as the observation array: it can be indexed, used in
+    arithmetic and NumPy functions, or converted with np.asarray. The array
+    is computed on the first access and kept. The shape and dtype are known
+    without computing it.
+
+    The environment gives the handle a compute function over a snapshot of
+    the state of its step, so a handle which is accessed after the
+    environment moved on still holds the observation of the step which
+    returned it. The action mask in the info of a step is given the same
+    way.
+    """
+
+    def __init__(self, compute, shape, dtype):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        compute     : callable
+            returns the observation array
+        shape       : tuple
+            shape of the observation
+        dtype       : dtype
+            dtype of the observation
+        """
+        self._compute = compute
+        self._value = None
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def materialized(self):
+        """ True if the observation was computed """
+        return self._value is not None
+
+    def freeze(self):
+        """ Compute the observation if it was not accessed yet, and return it """
+        if self._value is None:
+            self._value = self._compute()
+            self._compute = None
+        return self._value
+
+    def __array__(self, dtype=None, copy=None):
+        value = self.freeze()
+        if dtype is not None:
+            value = value.astype(dtype, copy=False)
+        return np.array(value) if copy else value
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = tuple(x.freeze() if isinstance(x, LazyObservation) else x for x in inputs)
+        if 'out' in kwargs:
+            kwargs['out'] = tuple(x.freeze() if isinstance(x, LazyObservation) else x for x in kwargs['out'])
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __getitem__(self, key):
+        return self.freeze()[key]
+
+    def __setitem__(self, key, value):
+        self.freeze()[key] = value
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __iter__(self):
+        return iter(self.freeze())
+
+    def __getattr__(self, name):
+        # Other ndarray attributes and methods (copy, sum, reshape, ...)
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.freeze(), name)
+
+    def __reduce__(self):
+        return (np.array, (self.freeze(),))
+
+    def __repr__(self):
+        if self._value is None:
+            return 'LazyObservation(shape={}, dtype={})'.format(self.shape, self.dtype)
+        return 'LazyObservation({!r})'.format(self._value)
+
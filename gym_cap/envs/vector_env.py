@@ -0,0 +1,239 @@
+import copy
+import types
+
+import numpy as np
+from gym import spaces
+
+from .cap_env import CapEnv
+from .const import *
+
+class CapVecEnv:
+    """
+    Batch of CapEnv stepped together
+
+    Every environment runs under CONTROL_ALL, and the vector environment
+    generates the actions of the policies for the whole batch. A policy
+    which implements `gen_action_batch(agent_states, observations)` is
+    called once per step for every environment; any other policy is
+    deep-copied for each environment and called with `gen_action` as in
+    CapEnv.step.
+
+    Finished environments are reset automatically. The last observation
+    of the finished episode is kept in info['terminal_observation'].
+
+    The constructor does not reset the batch (each CapEnv already builds
+    a board when it is created), so reset must be called before step.
+
+    All environments must have the same map size and number of units.
+    """
+
+    def __init__(self, num_envs, map_size=20, policy_blue=None, policy_red=None,
+                 custom_board=None, config_path=None, seed=None):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        num_envs        : int
+            number of environments
+        map_size        : int
+            size of the randomly generated boards
+        policy_blue     : Policy
+            policy of blue team, used when step is called without action
+        policy_red      : Policy
+            policy of red team
+        custom_board    : str or ndarray
+            board of every environment (optional)
+        config_path     : str
+            configuration file (optional)
+        seed            : int
+            seed of the first environment, the i-th is seeded with seed+i
+        """
+        self.num_envs = num_envs
+        self.map_size = map_size
+        self.custom_board = custom_board
+        self.config_path = config_path
+
+        self.envs = []
+        for idx in range(num_envs):
+            env = CapEnv(map_size=map_size, custom_board=custom_board, config_path=config_path)
+            env.CONTROL_ALL = True
+            if seed is not None:
+                env.seed(seed + idx)
+            self.envs.append(env)
+
+        self._policies = {TEAM1_BACKGROUND: policy_blue, TEAM2_BACKGROUND: policy_red}
+        self._env_policies = {}
+        for team, policy in self._policies.items():
+            if policy is not None and not self._batched(policy):
+                self._env_policies[team] = [self._copy_policy(policy) for _ in range(num_envs)]
+
+        self._set_spaces()
+        self._needs_reset = True
+
+    @staticmethod
+    def _copy_policy(policy):
+        """ Deep copy of the policy, sharing the modules it refers to (e.g. np.random) """
+        memo = {id(value): value for value in vars(policy).values() if isinstance(value, types.ModuleType)}
+        return copy.deepcopy(policy, memo)
+
+    @staticmethod
+    def _batched(policy):
+        return hasattr(policy, 'gen_action_batch')
+
+    def seed(self, seed=None):
+        return [env.seed(None if seed is None else seed + idx)[0] for idx, env in enumerate(self.envs)]
+
+    def reset(self):
+        """
+        Reset every environment
+
+        Return
+        ______
+        obs     : ndarray
+            (num_envs, h, w, NUM_CHANNEL) observations of blue team
+        """
+        for env in self.envs:
+            env.reset(custom_board=self.custom_board)
+        self._initiate(range(self.num_envs))
+        self._set_spaces()
+        self._needs_reset = False
+
+        return self.get_obs_blue
+
+    def _set_spaces(self):
+        num_blue = len(self.envs[0]._team_blue)
+        self.action_space = spaces.MultiDiscrete([len(CapEnv.ACTION)] * num_blue)
+        self.observation_space = self.envs[0].observation_space
+
+    def _initiate(self, env_ids):
+        """ Initiate the policies for the environments which were reset """
+        env_ids = list(env_ids)
+        for team, policy in self._policies.items():
+            if policy is None:
+                continue
+            teams = [self._team(self.envs[idx], team) for idx in env_ids]
+            if self._batched(policy):
+                policy.initiate_batch([self.envs[idx]._static_map for idx in env_ids], teams,
+                        [self.envs[idx]._map_index for idx in env_ids], env_ids=env_ids)
+            else:
+                for idx, members in zip(env_ids, teams):
+                    env = self.envs[idx]
+                    self._env_policies[team][idx].initiate(env._static_map, members,
+                            map_index=env._map_index)
+
+    @staticmethod
+    def _team(env, team):
+        return env._team_blue if team == TEAM1_BACKGROUND else env._team_red
+
+    @staticmethod
+    def _obs(env, team):
+        return env.get_obs_blue if team == TEAM1_BACKGROUND else env.get_obs_red
+
+    def _observation_type(self, team):
+        return CapEnv._observation_type(self._policies[team])
+
+    def _gen_actions(self, team, observations=None):
+        """
+        Actions of the team's policy for every environment, (num_envs, n_units)
+
+        The policy is given the observation it declares. The partial views
+        of the team can be passed as observations, (num_envs, h, w, NUM_CHANNEL).
+        """
+        policy = self._policies[team]
+        if policy is None:
+            raise ValueError('No policy for team {} and no actions provided'.format(team))
+        kind = self._observation_type(team)
+        if self._batched(policy):
+            if observations is None and kind == OBS_PARTIAL:
+                observations = np.stack([self._obs(env, team) for env in self.envs])
+            elif observations is None and kind != OBS_NONE:
+                observations = np.stack([env._policy_observation(team, kind) for env in self.envs])
+            states = np.stack([env._agent_states(team) for env in self.envs])
+            return np.asarray(policy.gen_action_batch(states, observations), dtype=int)
+
+        actions = []
+        for idx, (env, env_policy) in enumerate(zip(self.envs, self._env_policies[team])):
+            obs = env._policy_observation(team, kind) if observations is None else observations[idx]
+            if kind == OBS_PARTIAL:
+                env_policy.entities = env._entity_index(team, obs)
+            actions.append(env_policy.gen_action(self._team(env, team), obs))
+            env_policy.entities = None
+        return np.array(actions, dtype=int).reshape(self.num_envs, -1)
+
+    def step(self, actions=None):
+        """
+        Step every environment
+
+        Parameters
+        ----------
+        actions     : ndarray
+            (num_envs, n_blue) actions of blue team. If None, blue policy
+            generates the actions.
+
+        Return
+        ______
+        obs     : ndarray
+            (num_envs, h, w, NUM_CHANNEL) observations of blue team
+        rewards : ndarray
+            (num_envs,) rewards
+        dones   : ndarray
+            (num_envs,) True where the episode finished
+        infos   : list
+            info of each environment
+        """
+        if self._needs_reset:
+            raise RuntimeError('CapVecEnv.reset must be called before step')
+        has_red = len(self.envs[0]._team_red) > 0
+        fused = actions is None and has_red and \
+                self._observation_type(TEAM1_BACKGROUND) == self._observation_type(TEAM2_BACKGROUND) == OBS_PARTIAL
+        views = self.get_obs_teams if fused else None
+        if actions is None:
+            actions = self._gen_actions(TEAM1_BACKGROUND,
+                    None if views is None else views[:, TEAM1_BACKGROUND])
+        actions = np.asarray(actions, dtype=int).reshape(self.num_envs, -1)
+        if has_red:
+            actions = np.concatenate([actions, self._gen_actions(TEAM2_BACKGROUND,
+                    None if views is None else views[:, TEAM2_BACKGROUND])], axis=1)
+
+        observations, rewards, dones, infos = [], [], [], []
+        finished = []
+        for idx, (env, action) in enumerate(zip(self.envs, actions)):
+            obs, reward, done, info = env.step(action)
+            if done:
+                info['terminal_observation'] = obs
+                obs = env.reset(custom_board=self.custom_board)
+                finished.append(idx)
+            observations.append(obs)
+            rewards.append(reward)
+            dones.append(done)
+            infos.append(info)
+        if finished:
+            self._initiate(finished)
+
+        return np.stack(observations), np.array(rewards), np.array(dones), infos
+
+    @property
+    def get_obs_blue(self):
+        return np.stack([env.get_obs_blue for env in self.envs])
+
+    @property
+    def get_obs_red(self):
+        return np.stack([env.get_obs_red for env in self.envs])
+
+    @property
+    def get_obs_teams(self):
+        """ Observations of both teams, (num_envs, 2, h, w, NUM_CHANNEL) """
+        env = self.envs[0]
+        views = np.empty((self.num_envs, 2) + env._env.shape, dtype=env._env.dtype)
+        for env, out in zip(self.envs, views):
+            env._obs_teams(out)
+        return views
+
+    @property
+    def get_agent_states_blue(self):
+        return np.stack([env._agent_states(TEAM1_BACKGROUND) for env in self.envs])
+
+    @property
+    def get_agent_states_red(self):
+        return np.stack([env._agent_states(TEAM2_BACKGROUND) for env in self.envs])
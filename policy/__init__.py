@@ -6,3 +6,4 @@ from policy.defense import Defense
 from policy.astar_flag import AStar
 from policy.spiral import Spiral
 from policy.fighter import Fighter
+from policy.cooperative import Cooperative
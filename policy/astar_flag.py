@@ -19,6 +19,9 @@ class AStar(Policy):
         gen_action: Required method to generate a list of actions.
     """
 
+    observation_type = const.OBS_NONE
+    deterministic = True
+
     def __init__(self):
         """Constuctor for policy class.
         
@@ -31,12 +34,13 @@ class AStar(Policy):
 
         super().__init__()
 
-    def initiate(self, free_map, agent_list):
-        super().initiate(free_map, agent_list)
+    def initiate(self, free_map, agent_list, map_index=None):
+        super().initiate(free_map, agent_list, map_index)
         self.found_route = []
         self.agent_route = []
-        flag_id = const.TEAM2_FLAG if agent_list[0].team==const.TEAM1_BACKGROUND else const.TEAM1_FLAG
-        flag = tuple(np.argwhere(free_map==flag_id)[0])
+        flag = self.map_index.enemy_flag(agent_list[0].team)
+        if flag is None:
+            raise IndexError("Flag is not found for AStar")
         self.agent_steps = [0]*len(agent_list)
         for idx, agent in enumerate(agent_list):
             start = agent.get_loc()
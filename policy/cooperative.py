@@ -0,0 +1,239 @@
+"""Cooperative pathfinding agents policy generator.
+
+This module demonstrates windowed cooperative A* (WHCA*) for Capture the Flag
+environment. Units of the team plan one after another through space-time and
+reserve the (cell, time) pairs they will occupy, so later units route around
+them instead of bumping into them.
+
+The environment moves units of a team in list order and rejects a move into a
+cell which is still occupied. The reservation table follows the same rule, so
+the joint moves it returns are not rejected by the environment.
+"""
+
+import heapq
+from collections import deque
+
+import numpy as np
+import gym_cap.envs.const as const
+
+from policy.policy import Policy
+
+
+class ReservationTable:
+    """Space-time reservation table shared by the units of one team.
+
+    Each (cell, time) pair is owned by the index of the unit that reserves it.
+    Because the environment moves units in list order, a unit also cannot
+    step into a cell which a unit later in the list leaves on the same step,
+    and it cannot stay in a cell which a unit earlier in the list enters.
+    """
+
+    def __init__(self):
+        self._owner = {}
+        self._blocked = set()
+
+    def clear(self):
+        self._owner.clear()
+        self._blocked.clear()
+
+    def reserve(self, cell, t, idx):
+        self._owner[(cell, t)] = idx
+
+    def block(self, cell, t):
+        """Make the cell unavailable for every unit at time t."""
+        self._blocked.add((cell, t))
+
+    def is_free(self, cell, t, idx):
+        """Check if the unit idx can be at the cell at time t.
+
+        Args:
+            cell (tuple): coordinate
+            t (int): time step relative to the current step
+            idx (int): index of the unit in the team list
+
+        Return:
+            bool
+        """
+        if (cell, t) in self._blocked:
+            return False
+        owner = self._owner.get((cell, t))
+        if owner is not None and owner != idx:
+            return False
+        previous = self._owner.get((cell, t - 1))
+        if previous is not None and previous > idx:
+            return False
+        following = self._owner.get((cell, t + 1))
+        if following is not None and following < idx:
+            return False
+        return True
+
+
+class Cooperative(Policy):
+    """Policy generator class for CtF env.
+
+    Every ground unit heads to the enemy flag. The team replans each step
+    with a fixed space-time window, and each unit expands a bounded number
+    of states, so the cost of a team plan is bounded as well.
+
+    Methods:
+        gen_action: Required method to generate a list of actions.
+        plan: Method to find the conflict-free moves of the team.
+
+    Variables:
+        window : number of steps planned ahead
+        max_expansion : maximum number of space-time states expanded by unit
+    """
+
+    deterministic = True
+
+    def __init__(self, window=8, max_expansion=400, reservations=None):
+        """Constuctor for policy class.
+
+        Args:
+            window (int): number of steps planned ahead.
+            max_expansion (int): search budget of a single unit.
+            reservations (ReservationTable): table to share with other policy
+                objects which control the same team (optional).
+        """
+        super().__init__()
+        self.window = window
+        self.max_expansion = max_expansion
+        self.reservations = ReservationTable() if reservations is None else reservations
+
+    def initiate(self, free_map, agent_list, map_index=None):
+        super().initiate(free_map, agent_list, map_index)
+        self.goal = self.map_index.enemy_flag(agent_list[0].team)
+        if self.goal is None:
+            raise IndexError("Flag is not found for Cooperative")
+        self.goal_distance = self._distance_map(self.goal)
+
+    def gen_action(self, agent_list, observation):
+        """Action generation method.
+
+        This is a required method that generates list of actions corresponding
+        to the list of units.
+
+        Args:
+            agent_list (list): list of all friendly units.
+            observation (np.array): 2d map of partially observable map.
+
+        Returns:
+            action_out (list): list of integers as actions selected for team.
+        """
+        routes = self.plan(agent_list, observation)
+
+        action_out = []
+        for agent, route in zip(agent_list, routes):
+            if not agent.isAlive:
+                action_out.append(0)
+            elif agent.air:
+                action_out.append(self.move_toward(agent.get_loc(), self.goal))
+            elif route is None or len(route) < 2:
+                action_out.append(0)
+            else:
+                action_out.append(self.move_toward(route[0], route[1]))
+        return action_out
+
+    def plan(self, agent_list, observation):
+        """
+        Plan the space-time routes of the ground units in list order.
+
+        Args:
+            agent_list (list): list of all friendly units.
+            observation (np.array): 3d channel map of the team's view.
+
+        Return:
+            routes (list): list of coordinate for each time step, or None
+        """
+        table = self.reservations
+        table.clear()
+
+        # Current cells are taken at t=0, visible enemy units block t=1.
+        # A unit killed on the last step still holds its cell until its turn.
+        ground = [idx for idx, agent in enumerate(agent_list) if agent.isAlive and not agent.air]
+        for idx, agent in enumerate(agent_list):
+            if not agent.air:
+                table.reserve(agent.get_loc(), 0, idx)
+        if observation is not None:
+            enemy_ch = const.CHANNEL[const.TEAM2_UGV]
+            for x, y in np.argwhere(np.asarray(observation)[:, :, enemy_ch] == const.REPRESENT[const.TEAM2_UGV]):
+                table.block((int(x), int(y)), 1)
+
+        routes = [None] * len(agent_list)
+        for idx in ground:
+            route = self._space_time_search(agent_list[idx].get_loc(), idx)
+            for t, cell in enumerate(route):
+                table.reserve(cell, t, idx)
+            for t in range(len(route), self.window + 1):
+                table.reserve(route[-1], t, idx)
+            routes[idx] = route
+        return routes
+
+    def _space_time_search(self, start, idx):
+        """Bounded A* through (cell, time) with the true distance heuristic.
+
+        Return the route to the goal, or to the end of the window. If the
+        budget runs out, the route to the state closest to the goal is used.
+        """
+        table = self.reservations
+        mapx, mapy = self.free_map.shape
+        h = self.goal_distance
+
+        root = (start, 0)
+        came_from = {}
+        g_score = {root: 0}
+        open_heap = [(h[start], 0, start, 0)]
+        best = (h[start], root)
+        expansion = 0
+        final = None
+        while open_heap and expansion < self.max_expansion:
+            _, g, cell, t = heapq.heappop(open_heap)
+            if g > g_score[(cell, t)]:
+                continue
+            expansion += 1
+            if h[cell] < best[0]:
+                best = (h[cell], (cell, t))
+            if cell == self.goal or t == self.window:
+                final = (cell, t)
+                break
+
+            for move in range(5):
+                nx, ny = self.next_loc(cell, move)
+                if nx < 0 or nx >= mapx or ny < 0 or ny >= mapy:
+                    continue
+                if self.free_map[nx, ny] == const.OBSTACLE:
+                    continue
+                neighbour = ((nx, ny), t + 1)
+                if not table.is_free((nx, ny), t + 1, idx):
+                    continue
+                tentative = g + 1
+                if tentative < g_score.get(neighbour, np.inf):
+                    g_score[neighbour] = tentative
+                    came_from[neighbour] = (cell, t)
+                    heapq.heappush(open_heap, (tentative + h[nx, ny], tentative, (nx, ny), t + 1))
+
+        state = best[1] if final is None else final
+        route = [state[0]]
+        while state in came_from:
+            state = came_from[state]
+            route.append(state[0])
+        route.reverse()
+        return route
+
+    def _distance_map(self, goal):
+        """Breadth-first distance from every cell to the goal."""
+        mapx, mapy = self.free_map.shape
+        dist = np.full((mapx, mapy), mapx * mapy, dtype=int)
+        dist[goal] = 0
+        queue = deque([goal])
+        while queue:
+            cell = queue.popleft()
+            for move in range(1, 5):
+                nx, ny = self.next_loc(cell, move)
+                if nx < 0 or nx >= mapx or ny < 0 or ny >= mapy:
+                    continue
+                if self.free_map[nx, ny] == const.OBSTACLE or dist[nx, ny] <= dist[cell] + 1:
+                    continue
+                dist[nx, ny] = dist[cell] + 1
+                queue.append((nx, ny))
+        return dist
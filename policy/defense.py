@@ -21,14 +21,19 @@ class Defense(Policy):
 
     Methods:
         gen_action: Required method to generate a list of actions.
+        gen_action_batch: Method to generate the actions of a batch of environments.
         patrol: Private method to control a single unit.
     """
 
+    observation_type = const.OBS_STATIC
+
     def __init__(self):
         super().__init__()
+        self.flag_locations = np.zeros((0, 2), dtype=int)
+        self.flag_found = np.zeros(0, dtype=bool)
 
-    def initiate(self, free_map, agent_list):
-        self.free_map = free_map
+    def initiate(self, free_map, agent_list, map_index=None):
+        super().initiate(free_map, agent_list, map_index)
         self.free_map_old = free_map
         self.team = agent_list[0].team
 
@@ -58,9 +63,9 @@ class Defense(Policy):
         # search for a flag until finds it
         if self.flag_location == None:
 
-            loc = self.scan_obs(self.free_map, self.flag_code)
-            if len(loc) is not 0:
-                self.flag_location = loc[0]
+            loc = self.map_index.flags[self.flag_code]
+            if loc is not None:
+                self.flag_location = list(loc)
 
             for idx,agent in enumerate(agent_list):
                 a = self.random_search(agent, idx, self.free_map)
@@ -75,6 +80,61 @@ class Defense(Policy):
 
         return action_out
 
+    def initiate_batch(self, free_maps, agent_lists, map_indices=None, env_ids=None):
+        """Initiation for a batch of environments.
+
+        Args:
+            free_maps (list): 2d maps of static environment.
+            agent_lists (list): lists of all friendly units.
+            map_indices (list): analyses of the static maps (optional).
+            env_ids (list): index of each environment in the batch (optional).
+        """
+        env_ids = super().initiate_batch(free_maps, agent_lists, map_indices, env_ids)
+        self.random = np.random
+        self.exploration = 0.5
+        self.flag_code = const.TEAM1_FLAG
+
+        size = len(self.free_maps)
+        if size > len(self.flag_locations):
+            grow = size - len(self.flag_locations)
+            self.flag_locations = np.concatenate([self.flag_locations, np.zeros((grow, 2), dtype=int)])
+            self.flag_found = np.concatenate([self.flag_found, np.zeros(grow, dtype=bool)])
+        for idx in env_ids:
+            self.flag_found[idx] = False
+
+    def gen_action_batch(self, agent_states, observations):
+        """Action generation method for a batch of environments.
+
+        Same as gen_action for every environment: the units search randomly
+        on the first step of the episode, then approach the flag.
+
+        Args:
+            agent_states (np.array): (n_envs, n_units, 5) states of the units.
+            observations (np.array): observations of the environments.
+
+        Returns:
+            action_out (np.array): (n_envs, n_units) actions selected for teams.
+        """
+        shape = agent_states.shape[:2]
+        x = agent_states[:,:,const.STATE_X]
+        y = agent_states[:,:,const.STATE_Y]
+        fx = self.flag_locations[:,0,None]
+        fy = self.flag_locations[:,1,None]
+
+        approach = np.select([fx > x+1, fx < x-1, fy > y+1, fy < y-1], [2, 4, 3, 1], 0)
+        explore = self.random.random_sample(shape) < self.exploration
+        approach = np.where(explore, self.random.randint(0, 5, shape), approach)
+        action_out = np.where(self.flag_found[:,None], approach, self.random.randint(0, 5, shape))
+
+        # search for a flag until finds it
+        for idx in np.flatnonzero(~self.flag_found):
+            loc = self.map_indices[idx].flags[self.flag_code]
+            if loc is not None:
+                self.flag_locations[idx] = loc
+                self.flag_found[idx] = True
+
+        return action_out
+
     def random_search(self, agent, index, obs):
         """Generate 1 action for given agent object."""
         action = self.random.randint(0, 5)
@@ -101,11 +161,6 @@ class Defense(Policy):
         return action
 
     def scan_obs(self, obs, value):
-        location = []
-
-        for y in range(len(obs)):
-            for x in range(len(obs[0])):
-                if obs[x][y] == const.TEAM1_FLAG:
-                    location.append([x,y])
+        location = np.argwhere(np.asarray(obs).T == const.TEAM1_FLAG)[:, ::-1]
 
-        return location
+        return location.tolist()
@@ -16,13 +16,15 @@ class Fighter(Policy):
     Methods:
         gen_action: Required method to generate a list of actions.
     """
+
+    deterministic = True
     
     def __init__(self):
 
         super().__init__()
 
-    def initiate(self, free_map, agent_list):
-        super().initiate(free_map, agent_list)
+    def initiate(self, free_map, agent_list, map_index=None):
+        super().initiate(free_map, agent_list, map_index)
         self.agent_type = {agent_list[0]:'aggr',agent_list[1]:'aggr',agent_list[2]:'aggr',agent_list[3]:'def'}
     
     def gen_action(self, agent_list, observation):
@@ -65,6 +67,10 @@ class Fighter(Policy):
         """
         function for finding the nearest code
         """
+        if self.entities is not None:
+            nearest = self.entities.nearest(code, agent.get_loc())
+            return agent.get_loc() if nearest is None else nearest
+
         dist = []        
         end = np.argwhere(obs[:,:,CHANNEL[code]]==REPRESENT[code])
         if len(end) != 0:
@@ -95,7 +101,10 @@ class Fighter(Policy):
         """
         guard_radius = 4
         down_radius = 6
-        flag_x, flag_y = np.argwhere(obs[:,:,CHANNEL[TEAM1_FLAG]]==REPRESENT[TEAM1_FLAG])[0]
+        if self.entities is not None:
+            flag_x, flag_y = self.entities.positions(TEAM1_FLAG)[0]
+        else:
+            flag_x, flag_y = np.argwhere(obs[:,:,CHANNEL[TEAM1_FLAG]]==REPRESENT[TEAM1_FLAG])[0]
         enemy_x, enemy_y = self.search_nearest(agent,obs,TEAM2_UGV)
         x, y = agent.get_loc()
 
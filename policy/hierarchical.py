@@ -0,0 +1,344 @@
+"""Hierarchical path planner for large boards.
+
+This module implements a two-level (HPA*) planner over the static map of
+Capture the Flag environment. The board is divided into square clusters,
+entrances between neighbouring clusters and the intra-cluster costs are
+computed once per map, and a route query only searches the small abstract
+graph before stitching the cached local paths together.
+
+The planner is shared between policies through `get_planner`, which keeps
+one instance per distinct board.
+"""
+
+import heapq
+from collections import deque
+
+import numpy as np
+
+import gym_cap.envs.const as const
+
+_PLANNER_CACHE = {}
+_PLANNER_CACHE_SIZE = 16
+
+def get_planner(free_map, cluster_size=10):
+    """Return the planner for the given static map.
+
+    Planners are cached by the content of the map, so the preprocessing
+    runs once per board even if the environment is reset many times.
+
+    Args:
+        free_map (np.array): 2d map of static environment.
+        cluster_size (int): side length of a cluster.
+
+    Return:
+        HierarchicalPlanner
+    """
+    free_map = np.asarray(free_map)
+    key = (free_map.shape, cluster_size, hash(free_map.tobytes()))
+    planner = _PLANNER_CACHE.get(key)
+    if planner is None:
+        if len(_PLANNER_CACHE) >= _PLANNER_CACHE_SIZE:
+            _PLANNER_CACHE.pop(next(iter(_PLANNER_CACHE)))
+        planner = HierarchicalPlanner(free_map, cluster_size)
+        _PLANNER_CACHE[key] = planner
+    return planner
+
+
+class HierarchicalPlanner:
+    """Hierarchical A* (HPA*) over the static map.
+
+    The route is near-optimal: it is optimal on the abstract graph, and
+    local paths are shortest paths within a single cluster.
+
+    Attributes:
+        passable (np.array): 2d boolean map of cells which are not obstacle.
+        cluster_size (int): side length of a cluster.
+        GOAL_TREE_SIZE (int): number of goal trees kept in memory.
+    """
+
+    GOAL_TREE_SIZE = 32
+
+    def __init__(self, free_map, cluster_size=10):
+        self.passable = np.asarray(free_map) != const.OBSTACLE
+        self.cluster_size = cluster_size
+        self.shape = self.passable.shape
+        self._passable = self.passable.tolist()  # fast scalar lookup
+
+        self._edges = {}  # node -> {node: cost}
+        self._paths = {}  # (node, node) -> list of cells
+        self._cluster_nodes = {}  # cluster -> list of nodes
+        self._goal_trees = {}  # goal -> shortest path tree
+        self._goal_hits = {}  # goal -> number of queries, for goals without a tree
+
+        self._build_entrances()
+        for cluster, nodes in self._cluster_nodes.items():
+            for node in nodes:
+                cost, path = self._local_search(node, nodes)
+                for other in nodes:
+                    if other == node or other not in cost:
+                        continue
+                    self._link(node, other, cost[other], path[other])
+
+    def route(self, start, goal):
+        """
+        Finds route from start to goal.
+
+        Args:
+            start (tuple): coordinate of start position
+            goal (tuple): coordinate of end position
+
+        Return:
+            total_path (list):
+                List of coordinate in tuple.
+                Return None if path does not exist.
+        """
+        start, goal = tuple(start), tuple(goal)
+        if not (self._inside(start) and self._inside(goal)):
+            return None
+        if not (self.passable[start] and self.passable[goal]):
+            return None
+        if start == goal:
+            return [start]
+
+        start_cluster, goal_cluster = self._cluster(start), self._cluster(goal)
+        if start_cluster == goal_cluster:
+            cost, path = self._local_search(start, [goal])
+            if goal in cost:
+                return path[goal]
+
+        # Temporarily connect start and goal to the entrances of their clusters
+        start_cost, start_path = self._local_search(start, self._cluster_nodes.get(start_cluster, []))
+        if not start_cost:
+            return None
+
+        tree = self._goal_tree(goal)
+        if tree is not None:
+            return self._follow_tree(start, start_cost, start_path, *tree)
+
+        goal_cost, goal_path = self._local_search(goal, self._cluster_nodes.get(goal_cluster, []))
+        if not goal_cost:
+            return None
+
+        abstract = self._abstract_search(start, goal, start_cost, goal_cost)
+        if abstract is None:
+            return None
+
+        # Refine the abstract route with the cached local paths
+        total_path = [start]
+        for u, v in zip(abstract[:-1], abstract[1:]):
+            if u == start and v in start_path:
+                segment = start_path[v]
+            elif v == goal and u in goal_path:
+                segment = goal_path[u][::-1]
+            else:
+                segment = self._paths[(u, v)]
+            total_path.extend(segment[1:])
+        return total_path
+
+    def _goal_tree(self, goal):
+        """Return the shortest path tree towards a frequently queried goal.
+
+        Policies usually send every unit to the same target, so the second
+        query for a goal builds the tree of the whole abstract graph. Any
+        later query only needs the local search around its start.
+        """
+        if goal in self._goal_trees:
+            return self._goal_trees[goal]
+        hits = self._goal_hits.pop(goal, 0) + 1
+        if hits < 2:
+            if len(self._goal_hits) >= self.GOAL_TREE_SIZE:
+                self._goal_hits.pop(next(iter(self._goal_hits)))
+            self._goal_hits[goal] = hits
+            return None
+
+        goal_cost, goal_path = self._local_search(goal, self._cluster_nodes.get(self._cluster(goal), []))
+        dist = {}
+        succ = {}
+        open_heap = []
+        for node, cost in goal_cost.items():
+            dist[node] = cost
+            succ[node] = goal
+            open_heap.append((cost, node))
+        heapq.heapify(open_heap)
+        while open_heap:
+            d, current = heapq.heappop(open_heap)
+            if d > dist[current]:
+                continue
+            for neighbour, cost in self._edges[current].items():
+                tentative = d + cost
+                if tentative < dist.get(neighbour, np.inf):
+                    dist[neighbour] = tentative
+                    succ[neighbour] = current
+                    heapq.heappush(open_heap, (tentative, neighbour))
+
+        if len(self._goal_trees) >= self.GOAL_TREE_SIZE:
+            self._goal_trees.pop(next(iter(self._goal_trees)))
+        tree = (goal, dist, succ, goal_path)
+        self._goal_trees[goal] = tree
+        return tree
+
+    def _follow_tree(self, start, start_cost, start_path, goal, dist, succ, goal_path):
+        best = None
+        for node, cost in start_cost.items():
+            if node in dist and (best is None or cost + dist[node] < best[0]):
+                best = (cost + dist[node], node)
+        if best is None:
+            return None
+
+        u = best[1]
+        total_path = list(start_path[u])
+        while u != goal:
+            v = succ[u]
+            if v == goal and u in goal_path:
+                segment = goal_path[u][::-1]
+            else:
+                segment = self._paths[(u, v)]
+            total_path.extend(segment[1:])
+            u = v
+        return total_path
+
+    def _abstract_search(self, start, goal, start_cost, goal_cost):
+        """A* over the entrance graph with start and goal inserted."""
+        gx, gy = goal
+        heuristic = lambda n: abs(n[0] - gx) + abs(n[1] - gy)
+
+        # Ties on f are broken towards the deeper node
+        g_score = {start: 0}
+        came_from = {}
+        open_heap = [(heuristic(start), 0, start)]
+        closed = set()
+        while open_heap:
+            _, g, current = heapq.heappop(open_heap)
+            g = -g
+            if current in closed:
+                continue
+            if current == goal:
+                route = [current]
+                while current in came_from:
+                    current = came_from[current]
+                    route.append(current)
+                route.reverse()
+                return route
+            closed.add(current)
+
+            neighbours = list(self._edges.get(current, {}).items())
+            if current == start:
+                neighbours.extend(start_cost.items())
+            if current in goal_cost:
+                neighbours.append((goal, goal_cost[current]))
+            for neighbour, cost in neighbours:
+                tentative = g + cost
+                if tentative < g_score.get(neighbour, np.inf):
+                    g_score[neighbour] = tentative
+                    came_from[neighbour] = current
+                    heapq.heappush(open_heap, (tentative + heuristic(neighbour), -tentative, neighbour))
+        return None
+
+    def _build_entrances(self):
+        """Find entrances along every border between two clusters.
+
+        Each maximal run of passable cells on both sides of the border gives
+        one entrance in its middle, or two at its ends if the run is long.
+        """
+        c = self.cluster_size
+        h, w = self.shape
+        passable = self.passable
+
+        # Horizontal borders: between row x-1 and x
+        for x in range(c, h, c):
+            both = passable[x - 1, :] & passable[x, :]
+            for y0 in range(0, w, c):
+                for a, b in self._runs(both[y0:y0 + c]):
+                    for y in self._entrance_offsets(a, b):
+                        self._add_transition((x - 1, y0 + y), (x, y0 + y))
+
+        # Vertical borders: between column y-1 and y
+        for y in range(c, w, c):
+            both = passable[:, y - 1] & passable[:, y]
+            for x0 in range(0, h, c):
+                for a, b in self._runs(both[x0:x0 + c]):
+                    for x in self._entrance_offsets(a, b):
+                        self._add_transition((x0 + x, y - 1), (x0 + x, y))
+
+    @staticmethod
+    def _runs(line):
+        """Return [start, end) of each run of True values in a 1d array."""
+        padded = np.concatenate(([False], line, [False])).astype(np.int8)
+        edges = np.flatnonzero(np.diff(padded))
+        return zip(edges[::2], edges[1::2])
+
+    @staticmethod
+    def _entrance_offsets(a, b):
+        if b - a < 6:
+            return [(a + b - 1) // 2]
+        return [a, b - 1]
+
+    def _add_transition(self, u, v):
+        u = (int(u[0]), int(u[1]))
+        v = (int(v[0]), int(v[1]))
+        for node in (u, v):
+            if node not in self._edges:
+                self._edges[node] = {}
+                self._cluster_nodes.setdefault(self._cluster(node), []).append(node)
+        self._link(u, v, 1, [u, v])
+
+    def _link(self, u, v, cost, path):
+        if cost < self._edges[u].get(v, np.inf):
+            self._edges[u][v] = cost
+            self._edges[v][u] = cost
+            self._paths[(u, v)] = path
+            self._paths[(v, u)] = path[::-1]
+
+    def _local_search(self, source, targets):
+        """
+        Breadth-first search restricted to the cluster of the source.
+
+        Args:
+            source (tuple): coordinate of starting cell
+            targets (list): coordinates to find within the cluster
+
+        Return:
+            cost (dict): target -> path length, for reachable targets
+            path (dict): target -> list of coordinate from source
+        """
+        c = self.cluster_size
+        h, w = self.shape
+        x0 = (source[0] // c) * c
+        y0 = (source[1] // c) * c
+        x1, y1 = min(x0 + c, h), min(y0 + c, w)
+
+        passable = self._passable
+        remaining = set(targets)
+        remaining.discard(source)
+        came_from = {source: None}
+        depth = {source: 0}
+        queue = deque([source])
+        cost, path = {}, {}
+        if source in targets:
+            cost[source], path[source] = 0, [source]
+        while queue and remaining:
+            current = queue.popleft()
+            cx, cy = current
+            for nx, ny in ((cx + 1, cy), (cx - 1, cy), (cx, cy + 1), (cx, cy - 1)):
+                if not (x0 <= nx < x1 and y0 <= ny < y1):
+                    continue
+                neighbour = (nx, ny)
+                if neighbour in came_from or not passable[nx][ny]:
+                    continue
+                came_from[neighbour] = current
+                depth[neighbour] = depth[current] + 1
+                queue.append(neighbour)
+                if neighbour in remaining:
+                    remaining.discard(neighbour)
+                    route = [neighbour]
+                    while came_from[route[-1]] is not None:
+                        route.append(came_from[route[-1]])
+                    route.reverse()
+                    cost[neighbour], path[neighbour] = depth[neighbour], route
+        return cost, path
+
+    def _cluster(self, cell):
+        return (cell[0] // self.cluster_size, cell[1] // self.cluster_size)
+
+    def _inside(self, cell):
+        return 0 <= cell[0] < self.shape[0] and 0 <= cell[1] < self.shape[1]
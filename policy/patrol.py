@@ -27,68 +27,83 @@ class Patrol(Policy):
         patrol: Private method to control a single unit.
     """
 
+    observation_type = const.OBS_STATIC
+
     def __init__(self):
         super().__init__()
     
-    def initiate(self, free_map, agent_list):
+    def initiate(self, free_map, agent_list, map_index=None):
+        super().initiate(free_map, agent_list, map_index)
         self.team = agent_list[0].team
-        other_team = const.TEAM2_BACKGROUND if self.team==const.TEAM1_BACKGROUND else const.TEAM1_BACKGROUND
-        self.free_map = free_map 
-
-        # Scan and list boarder location
-        boarder = []
-        for i in range(len(free_map)):
-            for j in range(len(free_map[0])):
-                if free_map[i][j] == self.team:
-                    count = 0
-                    for move in range(1,5):
-                        nx, ny = self.next_loc((i,j), move)
-                        if nx < 0 or nx >= len(free_map): continue
-                        if ny < 0 or ny >= len(free_map[0]): continue
-                        if free_map[nx][ny] == other_team:
-                            count += 1
-                            break
-                    if count:
-                        boarder.append((i,j))
-        # Group boarder (BFS)
-        grouped_boarder = []
-        while len(boarder) > 0:
-            visited = []
-            queue = []
-            queue.append(boarder.pop()) 
-            while len(queue) > 0:
-                n = queue.pop()
-                visited.append(tuple(n))
-                for move in range(1,5):
-                    nx, ny = self.next_loc(n, move)
-                    if (nx,ny) in boarder:
-                        boarder.remove((nx,ny))
-                        queue.append((nx,ny))
-            grouped_boarder.append(visited)
-
-        boarder_centroid = [np.mean(boarder, axis=0) for boarder in grouped_boarder]
+
+        # Boarder locations grouped by connected component
+        self.boarder_labels = self.map_index.border_labels[self.team]
+        n_groups = self.boarder_labels.max() + 1
+        cells = np.argwhere(self.boarder_labels >= 0)
+        labels = self.boarder_labels[cells[:,0], cells[:,1]]
+        grouped_boarder = [self._walk([tuple(c) for c in cells[labels == group].tolist()])
+                           for group in range(n_groups)]
+
+        counts = np.bincount(labels, minlength=n_groups)[:, None]
+        boarder_centroid = np.stack([np.bincount(labels, cells[:,0], n_groups),
+                                     np.bincount(labels, cells[:,1], n_groups)], axis=1) / counts
 
         # Assign boarder
+        # Groups are compared from the one with the last cell in row-major
+        # order, so ties go to the same group as the scan of the boarder did
+        order = np.argsort([-np.ravel_multi_index(max(group), free_map.shape) for group in grouped_boarder],
+                           kind='stable')
         self.assigned = []
         for agent in agent_list:
             x = np.asarray(agent.get_loc())
-            dist = [sum(abs(x-centroid)) for centroid in boarder_centroid] # L1 norm
-            b = np.argmin(dist)
+            dist = np.abs(boarder_centroid[order] - x).sum(axis=1) # L1 norm
+            b = order[np.argmin(dist)]
             self.assigned.append(b)
 
         # Find path to boarder
+        # route_step[idx] gives the position of each cell along the route, -1 if not on the route
         self.route = []
+        self.route_step = []
         for idx, agent in enumerate(agent_list):
-            target = random.choice(grouped_boarder[self.assigned[idx]])
+            target = tuple(random.choice(grouped_boarder[self.assigned[idx]]))
             route = self.route_astar(agent.get_loc(), target)
+            self.route.append(route)
             if route is None:
-                self.route.append(None)
-            else: 
-                self.route.append(route)
+                self.route_step.append(None)
+            else:
+                route_step = np.full(free_map.shape, -1, dtype=int)
+                route_step[tuple(np.transpose(route))] = np.arange(len(route))
+                self.route_step.append(route_step)
 
         self.grouped_boarder = grouped_boarder
         self.heading_right = [True] * len(agent_list) #: Attr to track directions.
         
+    def _walk(self, group):
+        """Cells of a boarder group in the order of a depth-first walk.
+
+        The walk starts from the last cell in row-major order, so that the
+        route target drawn from the group does not depend on the labelling.
+
+        Args:
+            group (list): (x, y) cells of the group, in row-major order.
+
+        Returns:
+            visited (list): cells of the group in the order of the walk.
+        """
+        remaining = set(group)
+        remaining.remove(group[-1])
+        visited = []
+        queue = [group[-1]]
+        while len(queue) > 0:
+            n = queue.pop()
+            visited.append(n)
+            for move in range(1,5):
+                nxt = tuple(self.next_loc(n, move))
+                if nxt in remaining:
+                    remaining.remove(nxt)
+                    queue.append(nxt)
+        return visited
+
     def gen_action(self, agent_list, observation):
         """Action generation method.
         
@@ -109,23 +124,23 @@ class Patrol(Policy):
                 action_out.append(0)
                 continue
 
-            boarder = self.grouped_boarder[self.assigned[idx]]
+            group = self.assigned[idx]
             route = self.route[idx]
             cur_loc = agent.get_loc()
-            if cur_loc in boarder: ## Patrol
+            if self.boarder_labels[cur_loc] == group: ## Patrol
                 self.route[idx] = None
-                a = self.patrol(cur_loc, boarder, self.free_map)
+                a = self.patrol(cur_loc, group, self.free_map)
                 action_out.append(a)
-            elif route is None:
+            elif route is None or self.route_step[idx][cur_loc] < 0:
                 action_out.append(np.random.randint(5))
             else: ## Navigate to boarder
-                step = route.index(cur_loc)
+                step = self.route_step[idx][cur_loc]
                 new_loc = route[step+1]
                 action = self.move_toward(cur_loc, new_loc)
                 action_out.append(action)
         return action_out
 
-    def patrol(self, loc, boarder, obs):
+    def patrol(self, loc, group, obs):
         x,y = loc
         
         #patrol along the boarder.
@@ -133,6 +148,6 @@ class Patrol(Policy):
         for a in range(1,5):
             nx, ny = self.next_loc(loc, a)
             if not self.can_move(loc, a): continue
-            if (nx,ny) in boarder:
+            if self.boarder_labels[nx, ny] == group:
                 action.append(a)
         return np.random.choice(action)
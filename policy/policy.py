@@ -12,6 +12,8 @@ DOs/Denis Osipychev
 import numpy as np
 
 import gym_cap.envs.const as const
+from gym_cap.envs.map_index import MapIndex
+from policy.hierarchical import get_planner
 
 class Policy:
     """Policy generator class for CtF env.
@@ -23,7 +25,34 @@ class Policy:
     Must-have Methods:
         initiate: Required method that runs everytime episode is initialized.
         gen_action: Required method to generate a list of actions.
+
+    Optional Methods:
+        initiate_batch: Initiation for a batch of environments.
+        gen_action_batch(agent_states, observations): Generate the actions
+            of every environment of a batch at once. agent_states is an
+            (n_envs, n_units, 5) array with the columns const.STATE_*, and
+            observations is an (n_envs, h, w, NUM_CHANNEL) array. Returns an
+            (n_envs, n_units) array of actions. The vector environment calls
+            it instead of gen_action when it is defined.
+
+    Variables:
+        HIERARCHICAL_SIZE: boards with a side at least this long are routed
+            with the hierarchical planner in route_astar.
+        CLUSTER_SIZE: side length of a cluster for the hierarchical planner.
+        observation_type: observation given to gen_action, one of
+            const.OBS_NONE (None), OBS_STATIC (static map), OBS_FULL (flat
+            full state), OBS_PARTIAL (channel view of the team) or
+            OBS_EGOCENTRIC (list of the units' egocentric observations).
+            The environment only computes the declared observation.
+        deterministic: True if gen_action draws no random numbers. The
+            environment only ends an episode where no unit moved for
+            STALEMATE_STEPS steps when both policies declare it.
     """
+
+    HIERARCHICAL_SIZE = 64
+    CLUSTER_SIZE = 10
+    observation_type = const.OBS_PARTIAL
+    deterministic = False
     
     def __init__(self):
         """Constuctor for policy class.
@@ -33,10 +62,16 @@ class Policy:
         Define:
             agent_list (list): list of all friendly units.
             free_map (np.array): 2d map of static environment (optional).
+            entities (EntityIndex): visible entities of the current step,
+                set by the environment while gen_action runs (optional).
         
         """
         self.free_map = None
         self.agent_list = None
+        self.map_index = None
+        self.entities = None
+        self.free_maps = []
+        self.map_indices = []
         
     def gen_action(self, agent_list, observation):
         """Action generation method.
@@ -54,7 +89,7 @@ class Policy:
         """
         raise NotImplementedError
 
-    def initiate(self, free_map, agent_list):
+    def initiate(self, free_map, agent_list, map_index=None):
         """Initiation method
         
         This method is called when the environment reset
@@ -64,9 +99,40 @@ class Policy:
         Args:
             agent_list (list): list of all friendly units.
             free_map (np.array): 2d map of static environment (optional).
+            map_index (MapIndex): analysis of the static map, computed once
+                per board by the environment (optional).
         """
         self.free_map = free_map
         self.agent_list = agent_list
+        self.map_index = MapIndex.from_map(free_map) if map_index is None else map_index
+
+    def initiate_batch(self, free_maps, agent_lists, map_indices=None, env_ids=None):
+        """Initiation method for a batch of environments
+
+        This method is called by the vector environment, instead of initiate,
+        for the policies with gen_action_batch. Only the environments in
+        env_ids were reset, and the state kept for the others must not change.
+
+        Args:
+            free_maps (list): 2d maps of static environment.
+            agent_lists (list): lists of all friendly units.
+            map_indices (list): analyses of the static maps (optional).
+            env_ids (list): index of each environment in the batch.
+                Every environment of the batch is given if None.
+
+        Returns:
+            env_ids (list): index of each environment in the batch.
+        """
+        env_ids = list(range(len(free_maps)) if env_ids is None else env_ids)
+        if map_indices is None:
+            map_indices = [MapIndex.from_map(free_map) for free_map in free_maps]
+        size = max(env_ids) + 1
+        self.free_maps += [None] * (size - len(self.free_maps))
+        self.map_indices += [None] * (size - len(self.map_indices))
+        for idx, free_map, map_index in zip(env_ids, free_maps, map_indices):
+            self.free_maps[idx] = free_map
+            self.map_indices[idx] = map_index
+        return env_ids
 
     """
     All the methods below can be used to build policy.
@@ -130,9 +196,9 @@ class Policy:
             bool
         """
         nx, ny = self.next_loc(position, move)
-        if nx < 0 or nx >= 20:
+        if nx < 0 or nx >= self.free_map.shape[0]:
             return False
-        elif ny < 0 or ny >= 20:
+        elif ny < 0 or ny >= self.free_map.shape[1]:
             return False
         return self.free_map[nx][ny] != const.OBSTACLE
 
@@ -159,6 +225,8 @@ class Policy:
         Implemented A* algorithm
 
         *The 1-norm distance was used
+        *On large boards (see HIERARCHICAL_SIZE), the route is found by
+         hierarchical planner which is precomputed once per map.
 
         Args:
             start (tuple): coordinate of start position
@@ -171,13 +239,17 @@ class Policy:
 
         """
 
+        if len(goal) == 0:
+            return None
+        if max(self.free_map.shape) >= self.HIERARCHICAL_SIZE:
+            planner = get_planner(self.free_map, self.CLUSTER_SIZE)
+            return planner.route(start, goal)
+
         openSet = set([start])
         closedSet = set()
         cameFrom = {}
         fScore = {}
         gScore = {}
-        if len(goal) == 0:
-            return None
         fScore[start] = self.distance(start, goal)
         gScore[start] = 0
 
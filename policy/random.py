@@ -9,6 +9,7 @@ DOs/Denis Osipychev
 """
 
 import numpy as np
+import gym_cap.envs.const as const
 
 from policy.policy import Policy
 
@@ -21,7 +22,10 @@ class Random(Policy):
     
     Methods:
         gen_action: Required method to generate a list of actions.
+        gen_action_batch: Method to generate the actions of a batch of environments.
     """
+
+    observation_type = const.OBS_NONE
     
     def __init__(self):
         super().__init__()
@@ -41,9 +45,17 @@ class Random(Policy):
         Returns:
             action_out (list): list of integers as actions selected for team.
         """
-        action_out = []
-        
-        for i in agent_list:
-            action_out.append(self.random.randint(0, 5)) # choose random action
-        
-        return action_out
+        # one draw for the team (same sequence as a draw per unit)
+        return self.random.randint(0, 5, len(agent_list)).tolist()
+
+    def gen_action_batch(self, agent_states, observations):
+        """Action generation method for a batch of environments.
+
+        Args:
+            agent_states (np.array): (n_envs, n_units, 5) states of the units.
+            observations (np.array): observations of the environments.
+
+        Returns:
+            action_out (np.array): (n_envs, n_units) actions selected for teams.
+        """
+        return self.random.randint(0, 5, agent_states.shape[:2])
@@ -11,6 +11,7 @@ DOs/Denis Osipychev
 import numpy as np
 from collections import defaultdict
 
+import gym_cap.envs.const as const
 from policy.policy import Policy
 
 class Roomba(Policy):
@@ -21,15 +22,24 @@ class Roomba(Policy):
 
     Methods:
         gen_action: Required method to generate a list of actions.
-        policy: Method to determine the action based on observation for a single unit
-        scan : Method that returns the dictionary of object around the agent
+        gen_action_batch: Method to generate the actions of a batch of environments.
+        team_policy: Method to determine the actions of the whole team at once
 
     Variables:
         exploration : exploration rate
         previous_move : variable to save previous action
+        ENTITY_CODE : entity code of a (channel, value) pair in the observation
     """
 
-    def initiate(self, free_map, agent_list):
+    ENTITY_CODE = {(const.CHANNEL[code], const.REPRESENT[code]): code
+                   for code in [const.TEAM1_UGV, const.TEAM2_UGV, const.TEAM1_UAV,
+                                const.TEAM2_UAV, const.TEAM1_FLAG, const.TEAM2_FLAG]}
+
+    def __init__(self):
+        super().__init__()
+        self.previous_moves = []
+
+    def initiate(self, free_map, agent_list, map_index=None):
         """Constuctor for policy class.
 
         This class can be used as a template for policy generator.
@@ -37,13 +47,32 @@ class Roomba(Policy):
         Args:
             free_map (np.array): 2d map of static environment.
             agent_list (list): list of all friendly units.
+            map_index (MapIndex): analysis of the static map (optional).
+        """
+        super().initiate(free_map, agent_list, map_index)
+
+        self.set_params()
+        self.previous_move = self.random.randint(0, 5, len(agent_list)).tolist()
+
+    def initiate_batch(self, free_maps, agent_lists, map_indices=None, env_ids=None):
+        """Initiation for a batch of environments.
+
+        Args:
+            free_maps (list): 2d maps of static environment.
+            agent_lists (list): lists of all friendly units.
+            map_indices (list): analyses of the static maps (optional).
+            env_ids (list): index of each environment in the batch (optional).
         """
-        self.free_map = free_map
-        self.agent_list = agent_list
+        env_ids = super().initiate_batch(free_maps, agent_lists, map_indices, env_ids)
+
+        self.set_params()
+        self.previous_moves += [None] * (len(self.free_maps) - len(self.previous_moves))
+        for idx, agent_list in zip(env_ids, agent_lists):
+            self.previous_moves[idx] = self.random.randint(0, 5, len(agent_list)).tolist()
 
+    def set_params(self):
         self.random = np.random
         self.exploration = 0.05
-        self.previous_move = self.random.randint(0, 5, len(agent_list)).tolist()
 
         self.enemy_range = 4 # Range to see around and avoid enemy
         self.flag_range = 5  # Range to see the flag
@@ -63,116 +92,177 @@ class Roomba(Policy):
             action_out (list): list of integers as actions selected for team.
 
         """
-        action_out = []
-
-        for idx, agent in enumerate(agent_list):
-            # Initialize Variables
-            action = self.policy(agent, observation, idx)
-            action_out.append(action)
+        action_out = self.team_policy(agent_list, observation).tolist()
 
         return action_out
 
-    def policy(self, agent, obs, agent_id):
-        """ Policy
+    def gen_action_batch(self, agent_states, observations):
+        """Action generation method for a batch of environments.
+
+        Same as team_policy for every unit of every environment.
 
-        This method generate an action for given agent.
-        Agent is given with limited vision of a field.
-        This method provides simple protocol of movement based on the agent's location and it's vision.
+        Args:
+            agent_states (np.array): (n_envs, n_units, 5) states of the units.
+            observations (np.array): (n_envs, h, w, ch) observations.
+
+        Returns:
+            action_out (np.array): (n_envs, n_units) actions selected for teams.
+        """
+        n_envs, n_units = agent_states.shape[:2]
+        env_id = np.repeat(np.arange(n_envs), n_units)
+        states = agent_states.reshape(n_envs * n_units, -1)
+        pos = np.column_stack([env_id, states[:,const.STATE_X], states[:,const.STATE_Y]])
+
+        flags = np.argwhere(observations[..., 2] == -1)
+        enemies = np.argwhere(observations[..., 4] == -1)
+        previous = np.array(self.previous_moves, dtype=int).reshape(-1)
+
+        action = self.decide(pos, states[:,const.STATE_TEAM], flags, enemies,
+                             np.stack(self.free_maps), observations[..., 4], previous)
+        action = action.reshape(n_envs, n_units)
+
+        self.previous_moves = action.tolist()
+
+        return action
+
+    def team_policy(self, agent_list, obs):
+        """ Team policy
+
+        Each unit is given a simple protocol of movement based on its
+        location and the vision of the team.
 
         Protocol :
             1. Scan the area with flag_range:
                 - Flag within radius : Set the movement towards flag
-                - No Flag : random movement
+                - No Flag : continue the previous movement
             2. Scan the area with enemy_range:
                 - Enemy in the direction of movement
                     - If I'm in enemy's territory: reverse direction
-                    - Continue
-                - Else: contonue moving in the direction
+                    - If I'm in my territory: move toward the enemy
+                - Else: continue moving in the direction
             3. Random exploration
-                - 0.1 chance switching direction of movement
-                - Follow same direction
-                - Change direction if it heats the wall
+                - `exploration` chance of switching direction of movement
+                - Change direction if it hits the wall or another unit
+
+        The random numbers of the team are drawn once per step: one uniform
+        sample for each unit and each decision (flag direction, exploration,
+        exploration move, unblocking move).
+
+        Args:
+            agent_list (list): list of all friendly units.
+            obs (np.array): 3d channel map of partially observable map.
+
+        Returns:
+            action (np.array): actions selected for team.
         """
-        dir_x = [0, 0, 1, 0, -1] # dx for [stay, down, right, up, left]
-        dir_y = [0,-1, 0, 1,  0] # dy for [stay, down, right, up,left]
-        def blocking(x,y,d):
-            nx = x + dir_x[d]
-            ny = y + dir_y[d]
-            if nx < 0 or nx >= mapx: return True
-            elif ny < 0 or ny >= mapy: return True
+        n = len(agent_list)
+        loc = np.array([agent.get_loc() for agent in agent_list], dtype=int).reshape(n, 2)
+        pos = np.column_stack([np.zeros(n, dtype=int), loc])
+        team = np.array([agent.team for agent in agent_list])
+
+        flags = self.locate(obs, 2)
+        enemies = self.locate(obs, 4)
+        previous = np.array(self.previous_move, dtype=int)
+
+        action = self.decide(pos, team, flags, enemies, self.free_map[None], obs[None,:,:,4], previous)
+
+        # Save move
+        self.previous_move = action.tolist()
+
+        return action
+
+    def decide(self, pos, team, flags, enemies, free_map, ugv, previous):
+        """ Decision of the units of one or many environments
 
-            return self.free_map[nx][ny]==8 or obs[nx,ny,4] != 0
+        Args:
+            pos (np.array): (n, 3) environment index and coordinate of the units.
+            team (np.array): (n,) team of the units.
+            flags (np.array): (m, 3) environment index and coordinate of the enemy flags.
+            enemies (np.array): (k, 3) environment index and coordinate of the enemy units.
+            free_map (np.array): (n_envs, h, w) static maps.
+            ugv (np.array): (n_envs, h, w) ground unit channel of the observations.
+            previous (np.array): (n,) previous action of the units.
+
+        Returns:
+            action (np.array): (n,) actions selected for the units.
+        """
+        dir_x = np.array([0, 0, 1, 0, -1])
+        dir_y = np.array([0,-1, 0, 1,  0])
+        opposite_move = np.array([0, 3, 4, 1, 2])
 
-        lx, ly = agent.get_loc()
-        mapx, mapy = self.free_map.shape
+        n = len(pos)
+        env_id, x, y = pos[:,0], pos[:,1], pos[:,2]
+        rand = self.random.random_sample((n, 4))
+        rows = np.arange(n)
 
         # Continue the previous action
-        action = self.previous_move[agent_id]
-
-        # 1. Set direction to flag
-        is_flag, coord = self.obj_in_range(lx, ly, self.flag_range, obs, 2)
-        if is_flag:
-            fx, fy = coord[0]
-            action_pool = []
-            if fy > 0: # move down
-                action_pool.append(3)
-            if fy < 0: # move up
-                action_pool.append(1)
-            if fx > 0: # move left
-                action_pool.append(2)
-            if fx < 0: # move right
-                action_pool.append(4)
-            if action_pool == []:
-                action_pool = [0]
-            action = np.random.choice(action_pool)
-        
-        # 2. Scan with enemy range
-        in_home = self.free_map[agent.get_loc()] == agent.team
-        is_enemy, enemy_locs = self.obj_in_range(lx, ly, self.enemy_range, obs, 4)
-        opposite_move = [0, 3, 4, 1, 2]
-        for ex, ey in enemy_locs:
-            if not in_home:
-                if (ey > 0 and abs(ex) < 2 and action == 3) or \
-                   (ey < 0 and abs(ex) < 2 and action == 1) or \
-                   (ex > 0 and abs(ey) < 2 and action == 2) or \
-                   (ex < 0 and abs(ey) < 2 and action == 4):
-                    action = opposite_move[action]
-            else:
-                if ey > 0: # move down
-                    action = 3
-                elif ey < 0: # move up
-                    action = 1
-                elif ex > 0: # move left
-                    action = 2
-                elif ex < 0: # move right
-                    aciton = 4
-
-        if action == 0 or np.random.random() <= self.exploration: # Exploration
-            action = np.random.randint(1,5)
+        action = previous
+
+        # 1. Set direction to the first flag in range
+        rel, in_range = self.objs_in_range(pos, self.flag_range, flags)
+        if in_range.shape[1] > 0:
+            first = in_range.argmax(axis=1)
+            fx, fy = rel[rows, first, 0], rel[rows, first, 1]
+            vertical = np.where(fy > 0, 3, np.where(fy < 0, 1, 0))
+            horizontal = np.where(fx > 0, 2, np.where(fx < 0, 4, 0))
+            both = (vertical != 0) & (horizontal != 0)
+            toward_flag = np.where(both, np.where(rand[:,0] < 0.5, vertical, horizontal), vertical + horizontal)
+            action = np.where(in_range.any(axis=1), toward_flag, action)
+
+        # 2. Scan with enemy range, enemies are applied in order
+        in_home = free_map[env_id, x, y] == team
+        rel, in_range = self.objs_in_range(pos, self.enemy_range, enemies)
+        for k in range(in_range.shape[1]):
+            ex, ey = rel[:,k,0], rel[:,k,1]
+            near_x, near_y = np.abs(ex) < 2, np.abs(ey) < 2
+            reverse = ((ey > 0) & near_x & (action == 3)) | ((ey < 0) & near_x & (action == 1)) | \
+                      ((ex > 0) & near_y & (action == 2)) | ((ex < 0) & near_y & (action == 4))
+            chase = np.where(ey > 0, 3, np.where(ey < 0, 1, np.where(ex > 0, 2, action)))
+            action = np.where(in_range[:,k] & ~in_home & reverse, opposite_move[action], action)
+            action = np.where(in_range[:,k] & in_home, chase, action)
+
+        # 3. Random exploration
+        explore = (action == 0) | (rand[:,1] <= self.exploration)
+        action = np.where(explore, 1 + (rand[:,2] * 4).astype(int), action)
 
         # Checking obstacle
-        if blocking(lx, ly, action): # Wall or other obstacle
-            action_pool = [move for move in range(1,5) if not blocking(lx, ly, move)]
-            if action_pool == []:
-                action_pool = [0]
-            action = np.random.choice(action_pool)
-
-        # Save move
-        self.previous_move[agent_id] = action
+        n_envs, mapx, mapy = free_map.shape
+        blocked_cell = np.ones((n_envs, mapx+2, mapy+2), dtype=bool)
+        blocked_cell[:, 1:-1, 1:-1] = (free_map == 8) | (ugv != 0)
+        blocked = blocked_cell[env_id[:,None], x[:,None] + dir_x + 1, y[:,None] + dir_y + 1]
+        free_move = ~blocked[:,1:]
+        n_free = free_move.sum(axis=1)
+        pick = (rand[:,3] * n_free).astype(int)
+        unblock = np.where(n_free > 0, (free_move.cumsum(axis=1) > pick[:,None]).argmax(axis=1) + 1, 0)
+        action = np.where(blocked[rows, action], unblock, action)
 
         return action
 
-    def obj_in_range(self, x, y, r, obs, chn, elem=-1):
-        loc_list = np.where(obs[:,:,chn]==elem)
-        #rel_coord = np.column_stack(loc_list) - (x,y)
-        dif_coord = []
-        rsqr = r*r
-        for dx, dy in zip(*loc_list):
-            dx -= x
-            dy -= y
-            if dx*dx+dy*dy <= rsqr:
-                dif_coord.append((dx,dy))
-        return len(dif_coord)>0, dif_coord
+    def locate(self, obs, chn, elem=-1):
+        """ (m, 3) environment index (0) and coordinate of the objects in obs """
+        code = self.ENTITY_CODE.get((chn, elem))
+        if self.entities is not None and code is not None:
+            loc_list = self.entities.positions(code)
+        else:
+            loc_list = np.argwhere(obs[:,:,chn]==elem)
+        return np.column_stack([np.zeros(len(loc_list), dtype=int), loc_list])
+
+    def objs_in_range(self, pos, r, loc_list):
+        """ Relative coordinates of the objects from each unit
+
+        Args:
+            pos (np.array): (n, 3) environment index and coordinate of the units.
+            r (int): radius
+            loc_list (np.array): (k, 3) environment index and coordinate of the objects.
+
+        Returns:
+            rel (np.array): (n, k, 2) coordinates of the k objects relative to the n units.
+            in_range (np.array): (n, k) mask of the objects in the same environment
+                within the radius r.
+        """
+        rel = loc_list[None,:,1:] - pos[:,None,1:]
+        in_range = ((rel**2).sum(axis=2) <= r*r) & (loc_list[None,:,0] == pos[:,None,0])
+        return rel, in_range
 
     def center_pad(self, m, width, padder=8):
         lx, ly = m.shape
@@ -4,25 +4,41 @@ import math
 from policy.policy import Policy
 
 class Spiral(Policy):
+    """Policy generator class for CtF env.
+
+    Every unit covers the board with a spiral route from its spawn point.
+
+    Routes are cached by the content of the map and the start location,
+    so repeated boards and spawn points do not recompute them. A route is
+    kept as (n, 2) int16 array with the map of the step of each cell.
+
+    Variables:
+        ROUTE_CACHE_SIZE : number of routes kept in memory
+    """
+
+    ROUTE_CACHE_SIZE = 64
+    _route_cache = {}
+    observation_type = const.OBS_NONE
+    deterministic = True
 
     def __init__(self):
         super().__init__()
 
-    def initiate(self, free_map, agent_list):
-        super().initiate(free_map, agent_list)
+    def initiate(self, free_map, agent_list, map_index=None):
+        super().initiate(free_map, agent_list, map_index)
 
         self.enemy_range = 5  # Range to see around and avoid enemy
         self.flag_range = 5  # Range to see the flag
 
         self.found_route = []
         self.agent_route = []
-
-        self.agent_steps = [0] * len(agent_list)
+        self.route_step = []
 
         for idx, agent in enumerate(agent_list):
-            start = agent.get_loc()
-            self.agent_route.append(self.spiral(start))
-            self.found_route.append(self.agent_route[idx] is not None)
+            route, route_step = self.spiral_route(agent.get_loc())
+            self.agent_route.append(route)
+            self.route_step.append(route_step)
+            self.found_route.append(route is not None)
 
     def gen_action(self, agent_list, observation, free_map=None):
         action_out = []
@@ -32,57 +48,75 @@ class Spiral(Policy):
                 continue
 
             cur_loc = agent.get_loc()
-            if self.agent_route[idx][self.agent_steps[idx]] != cur_loc:
-                self.agent_steps[idx] += 1
-            cur_step = self.agent_steps[idx]
+            cur_step = self.route_step[idx][cur_loc]
 
-            if cur_step >= len(self.agent_route[idx]):
+            if cur_step < 0 or cur_step + 1 >= len(self.agent_route[idx]):
                 action_out.append(0)
                 continue
-            new_loc = self.agent_route[idx][cur_step + 1]
+            new_loc = tuple(self.agent_route[idx][cur_step + 1])
             action = self.move_toward(cur_loc, new_loc)
             action_out.append(action)
 
         return action_out
 
-    def spiral(self, loc):
-        route = [loc]
-        cur_idx = 0
-        mapx, mapy = self.free_map.shape
-
-        visit = np.full(shape=(mapx, mapy), fill_value=0)  # 0 is unknown, 1 is visited
-        visit[self.free_map == 8] = 1
+    def spiral_route(self, loc):
+        """
+        Return the cached spiral route from the location
+
+        Returns:
+            route (np.array): (n, 2) int16 array of coordinates.
+            route_step (np.array): 2d map of the first step of each cell
+                along the route, -1 if the cell is not on the route.
+        """
+        key = (self.map_index.hash, tuple(loc))
+        cached = self._route_cache.get(key)
+        if cached is None:
+            route = np.array(self.spiral(loc), dtype=np.int16)
+            route_step = np.full(self.free_map.shape, -1, dtype=np.int32)
+            # Assign in reverse so that the first step wins for repeated cells
+            steps = np.arange(len(route))[::-1]
+            route_step[route[::-1, 0], route[::-1, 1]] = steps
+            route.setflags(write=False)
+            route_step.setflags(write=False)
+            if len(self._route_cache) >= self.ROUTE_CACHE_SIZE:
+                self._route_cache.pop(next(iter(self._route_cache)))
+            cached = (route, route_step)
+            self._route_cache[key] = cached
+        return cached
 
-        def blocking(position,d):
-            nx, ny = self.next_loc(position, d)
-            if nx < 0 or nx >= mapx: return True
-            elif ny < 0 or ny >= mapy: return True
-
-            return visit[nx][ny] == 1
+    def spiral(self, loc):
+        """
+        Greedy coverage route from the location
 
+        Each step moves to the unvisited neighbour closest to the origin,
+        and the route ends when every neighbour is visited or blocked.
+        The distances and the visited cells are kept in flat lists.
+        """
+        mapx, mapy = self.free_map.shape
+        x0, y0 = loc
+        X, Y = np.ogrid[:mapx, :mapy]
+        dist = ((X - x0)**2 + (Y - y0)**2).ravel().tolist()   # squared distance from origin
+        visit = bytearray((np.asarray(self.free_map) == const.OBSTACLE).ravel().tolist())  # 1 is visited
+
+        # Candidates in the order [W, S, E, N]: ties go to the first
+        moves = [(-1, 0), (0, 1), (1, 0), (0, -1)]
+        route = [(x0, y0)]
+        x, y = x0, y0
         while True:
-            initial = x, y = route[cur_idx]
-            visit[x][y] = 1
-
-            action_pool = [move for move in range(1, 5) if not blocking(initial, move)]
-            if action_pool == []:   # no possible moves for agent
-                route.append(route[cur_idx])
-                return route
-
-            # out of possible moves, minimize distance from origin
-            minDist = None
+            visit[x*mapy + y] = 1
             final_location = None
-
-            for move in action_pool[::-1]:
-                new_loc = self.next_loc(initial, move)
-                dist = self.distance(loc, new_loc, True)
-
-                if minDist is None:
-                    minDist = dist
-                    final_location = new_loc
-                elif dist < minDist:
-                    minDist = dist
-                    final_location = new_loc
-
+            minDist = None
+            for dx, dy in moves:
+                nx, ny = x + dx, y + dy
+                if nx < 0 or nx >= mapx or ny < 0 or ny >= mapy: continue
+                if visit[nx*mapy + ny]: continue
+                d = dist[nx*mapy + ny]
+                if minDist is None or d < minDist:
+                    minDist = d
+                    final_location = (nx, ny)
+
+            if final_location is None:   # no possible moves for agent
+                route.append((x, y))
+                return route
             route.append(final_location)
-            cur_idx += 1
+            x, y = final_location
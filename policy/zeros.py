@@ -10,7 +10,8 @@ DOs/Denis Osipychev
 
 """
 
-#import numpy as np
+import numpy as np
+import gym_cap.envs.const as const
 
 from policy.policy import Policy
 
@@ -23,7 +24,12 @@ class Zeros(Policy):
     Methods:
         gen_action: Required method to generate a list of actions.
         patrol: Private method to control a single unit.
+        gen_action_batch: Method to generate the actions of a batch of environments.
     """
+
+    observation_type = const.OBS_NONE
+    deterministic = True
+
     def gen_action(self, agent_list, observation, free_map=None):
         """Action generation method.
         
@@ -47,3 +53,14 @@ class Zeros(Policy):
         
         return action_out
 
+    def gen_action_batch(self, agent_states, observations):
+        """Action generation method for a batch of environments.
+
+        Args:
+            agent_states (np.array): (n_envs, n_units, 5) states of the units.
+            observations (np.array): observations of the environments.
+
+        Returns:
+            action_out (np.array): (n_envs, n_units) actions selected for teams.
+        """
+        return np.zeros(agent_states.shape[:2], dtype=int)
@@ -5,8 +5,11 @@ import gym_cap
 import numpy as np
 import random
 import time
+import copy
 
 import policy
+import gym_cap.envs.const as const
+from gym_cap.envs.create_map import CreateMap
 
 ENV_NAME = 'cap-v0'
 
@@ -74,6 +77,19 @@ class TestBuild(unittest.TestCase):
             ])
         np.testing.assert_array_equal(render_state, test_render_state)
 
+    def testElementTables(self):
+        " Lookup tables follow CHANNEL, REPRESENT and COLOR_DICT, and the channel encoding round-trips"
+        for element, channel in const.CHANNEL.items():
+            self.assertEqual(const.ELEMENT_CHANNEL[element], channel)
+            self.assertEqual(const.ELEMENT_REPRESENT[element], const.REPRESENT[element])
+        for element, color in const.COLOR_DICT.items():
+            self.assertEqual(tuple(const.ELEMENT_COLOR[element]), color)
+        env = gym.make(ENV_NAME, custom_board='test_maps/board1.txt')
+        board = env.get_full_state
+        nd_map = CreateMap.flat_to_channel(board)
+        np.testing.assert_array_equal(CreateMap.channel_to_flat(nd_map), board)
+        np.testing.assert_array_equal(env.get_full_state_rgb, const.ELEMENT_COLOR[board])
+
 class TestRun(unittest.TestCase):
 
     def testStepWithPolicyProvided(self):
@@ -98,6 +114,160 @@ class TestRun(unittest.TestCase):
             s,r,d,i = env.step(action)
             if d: break
 
+    def testCooperativeMovesAreNotRejected(self):
+        " Joint moves from cooperative planner never collide within the team"
+        env = gym.make(
+                ENV_NAME,
+                policy_red=policy.random.Random(),
+            )
+        coop = policy.cooperative.Cooperative()
+        coop.initiate(env.get_map, env._team_blue)
+        dx = [0, 0, 1, 0, -1]
+        dy = [0, -1, 0, 1, 0]
+        for step in range(50):
+            action = coop.gen_action(env._team_blue, env.get_obs_blue)
+            before = [(agent.get_loc(), agent.isAlive) for agent in env._team_blue]
+            s,r,d,i = env.step(action)
+            for (loc, alive), agent, a in zip(before, env._team_blue, action):
+                if alive and a != 0:
+                    self.assertEqual(agent.get_loc(), (loc[0]+dx[a], loc[1]+dy[a]))
+            if d: break
+
+    def testPatrolStaysOnBorder(self):
+        " Patrol units keep to their border group once they reach it"
+        patrol = policy.Patrol()
+        env = gym.make(ENV_NAME, policy_blue=patrol, policy_red=policy.Zeros())
+        reached = [False] * len(env._team_blue)
+        for step in range(100):
+            s,r,d,i = env.step()
+            if d: break
+            for idx, agent in enumerate(env._team_blue):
+                on_border = patrol.boarder_labels[agent.get_loc()] == patrol.assigned[idx]
+                if reached[idx] and agent.isAlive:
+                    self.assertTrue(on_border)
+                reached[idx] |= on_border
+
+    def testRoombaTeamPolicy(self):
+        " Team Roomba never chooses a blocked move when a free one exists"
+        roomba = policy.Roomba()
+        env = gym.make(ENV_NAME, policy_blue=roomba, policy_red=policy.Roomba())
+        dx = [0, 0, 1, 0, -1]
+        dy = [0, -1, 0, 1, 0]
+        h, w = env.map_size
+        for step in range(50):
+            obs = env.get_obs_blue
+            def blocked(x, y):
+                return not (0 <= x < h and 0 <= y < w) or env._static_map[x, y] == 8 or obs[x, y, 4] != 0
+            actions = roomba.team_policy(env._team_blue, obs)
+            for agent, a in zip(env._team_blue, actions):
+                x, y = agent.get_loc()
+                if all(blocked(x+dx[m], y+dy[m]) for m in range(1, 5)):
+                    self.assertEqual(a, 0)
+                else:
+                    self.assertNotEqual(a, 0)
+                    self.assertFalse(blocked(x+dx[a], y+dy[a]))
+            s,r,d,i = env.step()
+            if d: break
+
+    def testSpiralRouteCache(self):
+        " Spiral routes are continuous and reused for the same board and start"
+        env = gym.make(ENV_NAME)
+        spiral = policy.Spiral()
+        spiral.initiate(env.get_map, env._team_blue)
+        for agent, route, route_step in zip(env._team_blue, spiral.agent_route, spiral.route_step):
+            self.assertEqual(route.dtype, np.int16)
+            self.assertEqual(tuple(route[0]), agent.get_loc())
+            self.assertEqual(route_step[agent.get_loc()], 0)
+            self.assertTrue((np.abs(np.diff(route, axis=0)).sum(axis=1) <= 1).all())
+            self.assertIs(spiral.spiral_route(agent.get_loc())[0], route)
+
+    def testActionMask(self):
+        " Action mask marks the moves which change the position of the unit"
+        env = gym.make(ENV_NAME, policy_red=policy.Random())
+        env.NUM_UAV = 2
+        env.reset()
+        for step in range(30):
+            mask = env.get_action_mask
+            self.assertEqual(mask.shape, (len(env._team_blue), 5))
+            for agent, valid in zip(env._team_blue, mask):
+                for a in range(5):
+                    moved = copy.deepcopy(agent)
+                    moved.move(env.ACTION[a], env._env.copy(), env._static_map)
+                    self.assertEqual(valid[a], a == 0 or moved.get_loc() != agent.get_loc())
+            s,r,d,i = env.step(env.action_space.sample())
+            np.testing.assert_array_equal(i['action_mask'], env.get_action_mask)
+            if d: break
+
+    def testMultiDiscrete(self):
+        " MultiDiscrete actions move the units as the encoded Discrete action"
+        env_int = gym.make(ENV_NAME, policy_red=policy.Zeros())
+        env_multi = gym.make(ENV_NAME, policy_red=policy.Zeros())
+        env_multi.MULTI_DISCRETE = True
+        for env in [env_int, env_multi]:
+            np.random.seed(0)
+            random.seed(0)
+            env.seed(0)
+            env.reset()
+        n = len(env_multi._team_blue)
+        self.assertEqual(env_multi.action_space.shape, (n,))
+        for step in range(30):
+            action = env_multi.action_space.sample()
+            code = int(np.sum(action * 5 ** np.arange(n)))
+            env_int.step(np.int64(code))
+            env_multi.step(action)
+            self.assertEqual([a.get_loc() for a in env_int._team_blue],
+                             [a.get_loc() for a in env_multi._team_blue])
+
+        # Beyond 27 units the Discrete action does not fit in int64
+        env_int.NUM_BLUE = 30
+        env_int.reset()
+        action = np.random.randint(0, 5, 30).tolist()
+        code = sum(a * 5 ** i for i, a in enumerate(action))
+        self.assertEqual(env_int._decode_action(code, 30), action)
+        env_int.step(code)
+
+    def testFullStateCache(self):
+        " Flat state is computed once per step and read-only"
+        env = gym.make(ENV_NAME, policy_blue=policy.Random(), policy_red=policy.Random())
+        for step in range(10):
+            state = env.get_full_state
+            self.assertIs(state, env.get_full_state)
+            self.assertFalse(state.flags.writeable)
+            for agent in env._team_blue + env._team_red:
+                if agent.isAlive:
+                    self.assertIn(state[agent.get_loc()], [const.TEAM1_UGV, const.TEAM1_UAV, const.TEAM2_UGV, const.TEAM2_UAV])
+            np.testing.assert_array_equal(env.get_obs_blue_render[~env._blue_mask], state[~env._blue_mask])
+            s,r,d,i = env.step()
+            if d: break
+
+    def testTeamView(self):
+        " Team accessors return the same tuple of units until the next reset"
+        env = gym.make(ENV_NAME, policy_blue=policy.Random(), policy_red=policy.Random())
+        team = env.get_team_blue
+        self.assertIsInstance(team, tuple)
+        env.step()
+        self.assertIs(team, env.get_team_blue)
+        self.assertEqual(list(env.get_team_red), env._team_red)
+        env.reset()
+        self.assertIsNot(team, env.get_team_blue)
+
+    def testMoveUnits(self):
+        " Team move kernel matches the moves of the units in list order"
+        from gym_cap.envs.agent import move_units
+        env = gym.make(ENV_NAME, policy_red=policy.Zeros())
+        env.NUM_BLUE, env.NUM_RED = 8, 8
+        env.reset(map_size=10)
+        units = env._team_blue + env._team_red
+        units[3].isAlive = False
+        for step in range(30):
+            actions = np.random.randint(0, 5, len(units))
+            expected_units, expected_env = copy.deepcopy(units), env._env.copy()
+            for agent, a in zip(expected_units, actions):
+                agent.move(int(a), expected_env, env._static_map)
+            move_units(units, actions, env._env, env._static_map, vectorized=True)
+            np.testing.assert_array_equal(env._env, expected_env)
+            self.assertEqual([a.get_loc() for a in units], [a.get_loc() for a in expected_units])
+
 class TestInteraction(unittest.TestCase):
     
     def testDeterministicInteractionRun(self):
@@ -126,14 +296,286 @@ class TestInteraction(unittest.TestCase):
             s,r,d,i = env.step(action)
             if d: break
 
+    def testThreatMap(self):
+        " Threat map counts the enemy ground units in attack range"
+        env = gym.make(ENV_NAME, policy_blue=policy.Random(), policy_red=policy.Random())
+        for stoch in [False, True]:
+            env.STOCH_ATTACK = stoch
+            env.reset()
+            for step in range(10):
+                threat = env.get_threat_blue
+                for x, y in np.ndindex(*env.map_size):
+                    count = sum((x-e.x)**2 + (y-e.y)**2 <= e.a_range**2
+                                for e in env._team_red
+                                if e.isAlive and not e.air and not env._blue_mask[e.x, e.y])
+                    if env._static_map[x, y] == 0:
+                        expected = count if stoch else 0
+                    else:
+                        expected = count + env.STOCH_ATTACK_BIAS if stoch and count else count
+                    self.assertEqual(threat[x, y], expected)
+                s, r, d, i = env.step()
+                if d: break
+
+class TestRoute(unittest.TestCase):
+
+    @repeat(3)
+    def testHierarchicalRoute(self):
+        " Route on large board is continuous and avoids obstacle"
+        _, static_map, _ = gym_cap.envs.create_map.CreateMap.gen_map('map', 120)
+        planner = policy.hierarchical.get_planner(static_map)
+        free = np.argwhere(static_map != 8)
+        for _ in range(20):
+            start = tuple(free[np.random.randint(len(free))])
+            goal = tuple(free[np.random.randint(len(free))])
+            route = planner.route(start, goal)
+            if route is None: continue
+            self.assertEqual(route[0], start)
+            self.assertEqual(route[-1], goal)
+            for a, b in zip(route[:-1], route[1:]):
+                self.assertEqual(abs(a[0]-b[0]) + abs(a[1]-b[1]), 1)
+                self.assertNotEqual(static_map[b], 8)
+
+class TestMapIndex(unittest.TestCase):
+
+    @repeat(5)
+    def testBorder(self):
+        " Border cells and flags match the scan of the static map"
+        env = gym.make(ENV_NAME)
+        index = env.get_map_index
+        static_map = env.get_map
+        h, w = static_map.shape
+        for team, other in [(0, 1), (1, 0)]:
+            border = np.zeros((h, w), dtype=bool)
+            for i, j in np.ndindex(h, w):
+                if static_map[i, j] != team: continue
+                for ni, nj in [(i+1, j), (i-1, j), (i, j+1), (i, j-1)]:
+                    if 0 <= ni < h and 0 <= nj < w and static_map[ni, nj] == other:
+                        border[i, j] = True
+            np.testing.assert_array_equal(index.border[team], border)
+            labels = index.border_labels[team]
+            self.assertTrue((labels[border] >= 0).all() and (labels[~border] == -1).all())
+        self.assertEqual(static_map[index.flag(0)], const.TEAM1_FLAG)
+        self.assertEqual(static_map[index.enemy_flag(0)], const.TEAM2_FLAG)
+        self.assertIs(gym_cap.envs.map_index.MapIndex.from_map(static_map), index)
+
+    def testComponents(self):
+        " Connected components of a mask"
+        mask = np.array([[1, 1, 0, 1],
+                         [0, 1, 0, 1],
+                         [1, 0, 0, 1],
+                         [1, 1, 0, 0]], dtype=bool)
+        labels, count = gym_cap.envs.map_index.label_components(mask)
+        self.assertEqual(count, 3)
+        np.testing.assert_array_equal(labels, [[0, 0, -1, 1],
+                                               [-1, 0, -1, 1],
+                                               [2, -1, -1, 1],
+                                               [2, 2, -1, -1]])
+
+class TestEntityIndex(unittest.TestCase):
+
+    def testPositions(self):
+        " Entity index matches the scan of the team's view"
+        env = gym.make(ENV_NAME, policy_blue=policy.Roomba(), policy_red=policy.Roomba())
+        codes = [const.TEAM1_UGV, const.TEAM2_UGV, const.TEAM1_UAV,
+                 const.TEAM2_UAV, const.TEAM1_FLAG, const.TEAM2_FLAG]
+        for step in range(20):
+            for view, index in [(env.get_obs_blue, env.get_entities_blue),
+                                (env.get_obs_red, env.get_entities_red)]:
+                for code in codes:
+                    expected = np.argwhere(view[:,:,const.CHANNEL[code]] == const.REPRESENT[code])
+                    np.testing.assert_array_equal(index.positions(code).reshape(-1, 2), expected)
+                if len(expected):
+                    nearest = min(map(tuple, expected), key=lambda p: p[0]**2 + p[1]**2)
+                    self.assertEqual(index.nearest(code, (0, 0)), nearest)
+                    self.assertEqual(len(index.in_radius(code, expected[0], 0)), 1)
+            s, r, d, i = env.step()
+            if d: break
+
+class TestVecEnv(unittest.TestCase):
+
+    def run_batch(self, policy_blue, policy_red, num_envs=4, test_maxstep=60):
+        vec_env = gym_cap.envs.CapVecEnv(num_envs, policy_blue=policy_blue, policy_red=policy_red)
+        with self.assertRaises(RuntimeError):
+            vec_env.step()
+        vec_env.seed(0)
+        np.random.seed(0)
+        random.seed(0)
+        vec_env.reset()
+        states = []
+        for step in range(test_maxstep):
+            obs, rewards, dones, infos = vec_env.step()
+            self.assertEqual(obs.shape[0], num_envs)
+            for done, info in zip(dones, infos):
+                if done: self.assertIn('terminal_observation', info)
+            states.append(vec_env.get_agent_states_blue)
+            views = vec_env.get_obs_teams
+            np.testing.assert_array_equal(views[:, 0], vec_env.get_obs_blue)
+            np.testing.assert_array_equal(views[:, 1], vec_env.get_obs_red)
+        return np.array(states)
+
+    def testBatchedPolicy(self):
+        " Batched policy generates the same actions as the per-environment policies"
+        class Unbatched(policy.Roomba):
+            @property
+            def gen_action_batch(self):
+                raise AttributeError
+        batched = self.run_batch(policy.Roomba(), policy.Roomba())
+        unbatched = self.run_batch(Unbatched(), Unbatched())
+        np.testing.assert_array_equal(batched, unbatched)
+
+    def testPolicies(self):
+        " Batched policies and per-environment policies (Patrol) run in the vector environment"
+        for policy_blue in [policy.Random(), policy.Zeros(), policy.Defense(), policy.Patrol()]:
+            self.run_batch(policy_blue, policy.Random(), test_maxstep=20)
+
+class TestRollout(unittest.TestCase):
+
+    def testSameAsStep(self):
+        " Rollout gives the outcome of the same episodes played with step"
+        env = gym.make(ENV_NAME, policy_blue=policy.Roomba(), policy_red=policy.Random()).unwrapped
+        fields = ['blue_win', 'red_win', 'blue_flag_captured', 'red_flag_captured', 'blue_eliminated', 'red_eliminated']
+        for seed in range(3):
+            np.random.seed(seed)
+            random.seed(seed)
+            env.seed(seed)
+            records = env.rollout(max_steps=100, n_episodes=2)
+            self.assertEqual(records.dtype, const.ROLLOUT_DTYPE)
+            self.assertEqual(records.shape, (2,))
+
+            np.random.seed(seed)
+            random.seed(seed)
+            env.seed(seed)
+            for record in records:
+                env.reset()
+                for _ in range(100):
+                    if env.step()[2]:
+                        break
+                self.assertEqual(record['steps'], env.run_step)
+                for field in fields:
+                    self.assertEqual(record[field], getattr(env, field))
+                self.assertEqual(record['blue_alive'], sum(agent.isAlive for agent in env._team_blue))
+                self.assertEqual(record['red_alive'], sum(agent.isAlive for agent in env._team_red))
+
+    def testSettings(self):
+        " Rollout is seeded by the environment, resets the mode and rejects CONTROL_ALL"
+        env = gym.make(ENV_NAME, policy_blue=policy.Random(), policy_red=policy.Random()).unwrapped
+        boards = ['test_maps/board{}.txt'.format(i) for i in range(1, 5)]
+        outcomes = []
+        for _ in range(2):
+            env.seed(3)
+            np.random.seed(3)
+            outcomes.append(env.rollout(max_steps=30, n_episodes=4, custom_board=boards))
+        np.testing.assert_array_equal(outcomes[0], outcomes[1])
+
+        board = np.loadtxt('test_maps/board1.txt', dtype=int)
+        board[board == const.TEAM2_UGV] = const.TEAM2_BACKGROUND
+        env.rollout(max_steps=5, custom_board=board)
+        self.assertEqual(env.mode, 'sandbox')
+        env.rollout(max_steps=5, custom_board='test_maps/board1.txt')
+        self.assertEqual(env.mode, 'random')
+
+        env.CONTROL_ALL = True
+        with self.assertRaises(ValueError):
+            env.rollout()
+
+class TestStalemate(unittest.TestCase):
+
+    def testStill(self):
+        " Episode ends after STALEMATE_STEPS steps without any move"
+        env = gym.make(ENV_NAME, policy_blue=policy.Zeros(), policy_red=policy.Zeros())
+        env.STALEMATE_STEPS = 5
+        env.reset()
+        for step in range(5):
+            s, r, d, info = env.step()
+            self.assertEqual(d, step == 4)
+        self.assertEqual(info['end_reason'], const.END_STALEMATE)
+        records = env.rollout(max_steps=100, n_episodes=2)
+        self.assertTrue(records['stalemate'].all())
+        self.assertTrue((records['steps'] == 5).all())
+
+    def testStillNeedsDeterministicPolicies(self):
+        " Standing still is not a stalemate with random or external actions"
+        env = gym.make(ENV_NAME, policy_blue=policy.Zeros(), policy_red=policy.Zeros())
+        env.STALEMATE_STEPS = 5
+        env.reset()
+        for step in range(10):
+            self.assertFalse(env.step([0] * len(env._team_blue))[2])
+        stay = policy.Random()
+        stay.gen_action = lambda agent_list, observation: [0] * len(agent_list)
+        env.reset(policy_blue=stay)
+        for step in range(10):
+            self.assertFalse(env.step()[2])
+
+    def testNoContact(self):
+        " Episode ends when the teams are walled off from each other"
+        board = np.loadtxt('test_maps/board1.txt', dtype=int)
+        board[8:10, :] = const.OBSTACLE
+        env = gym.make(ENV_NAME, policy_blue=policy.Random(), policy_red=policy.Random())
+        env.STALEMATE_STEPS = 100
+        env.reset(custom_board=board)
+        self.assertTrue(env.step()[2])
+        env.STALEMATE_STEPS = 0
+        env.reset(custom_board=board)
+        self.assertFalse(env.step()[2])
+        env.STALEMATE_STEPS = 100
+        board[9, 3] = const.TEAM1_BACKGROUND  # red can enter blue territory within blue's range
+        env.reset(custom_board=board)
+        s, r, d, info = env.step()
+        self.assertFalse(d)
+        self.assertIsNone(info['end_reason'])
+
 class TestAgentTeamMemory(unittest.TestCase):
-    pass
+
+    def testLastSeen(self):
+        " Last-seen memory follows the board size and records the seen state"
+        env = gym.make(ENV_NAME, policy_blue=policy.Random(), policy_red=policy.Random())
+        env.TEAM_MEMORY = "fog"
+        for size in [20, 30]:
+            env.reset(map_size=size)
+            memory = env.get_team_memory_blue
+            self.assertEqual(memory.last_seen.shape, (size, size))
+            self.assertFalse(memory.seen.any())
+            for step in range(1, 6):
+                env.step()
+                seen = np.zeros((size, size), dtype=bool)
+                for entity in env._team_blue:
+                    seen |= entity.get_vision(env)
+                self.assertTrue((memory.last_seen[seen] == step).all())
+                self.assertEqual(memory.last_seen.max(), step)
+                self.assertTrue((memory.age(step)[seen] == 0).all())
+            self.assertTrue((env.blue_memory[memory.seen] == env._static_map[memory.seen]).all())
 
 class TestAgentIndivMemory(unittest.TestCase):
-    pass
+
+    def testLazyMemory(self):
+        " Memory is only allocated with fog and agents have no instance dict"
+        env = gym.make(ENV_NAME, policy_blue=policy.Random(), policy_red=policy.Random())
+        env.reset(map_size=20)
+        self.assertIsNone(env.blue_memory)
+        self.assertIsNone(env.get_team_memory_blue)
+        for agent in env._team_blue + env._team_red:
+            self.assertIsNone(agent.memory)
+            self.assertFalse(hasattr(agent, '__dict__'))
+        env.INDIV_MEMORY = "fog"
+        env.reset(map_size=20)
+        env.step()
+        for agent in env._team_blue:
+            self.assertEqual(agent.memory.dtype, np.int8)
+            vision = agent.get_vision(env)
+            self.assertTrue((agent.memory[vision] == env._static_map[vision]).all())
 
 class TestAgentGetObs(unittest.TestCase):
 
+    def testWindowSize(self):
+        " Egocentric window is centered on the agent for any map size"
+        for size in [10, 20, 30]:
+            env = gym.make(ENV_NAME, map_size=size)
+            for entity in env._team_blue+env._team_red:
+                obs = entity.get_obs(env)
+                self.assertEqual(obs.shape, (2*size-1, 2*size-1))
+                x, y = entity.get_loc()
+                self.assertEqual(obs[size-1, size-1], env.get_full_state[x, y])
+
     @repeat(10)
     def testFrequency(self):
         " Communication frequency test"
@@ -142,7 +584,126 @@ class TestAgentGetObs(unittest.TestCase):
         env.reset()
         for entity in env._team_blue+env._team_red:
             entity.get_obs(env)
-                
+
+    def testFrequencyDropout(self):
+        " Shared cells are dropped only among the cells each unit receives"
+        env = gym.make(ENV_NAME)
+        env.COM_GROUND = True
+        env.COM_FREQUENCY = 0.5
+        env.reset()
+        graph = env._communication_graph(const.TEAM1_BACKGROUND)
+        for entity in env._team_blue:
+            received = graph.received_vision(entity)
+            shared = graph.shared_vision(entity)
+            self.assertFalse((received & ~shared).any())
+            h, w = env.map_size
+            x, y = entity.get_loc()
+            seen = (entity.get_obs(env) != const.UNKNOWN)[h-1-x:2*h-1-x, w-1-y:2*w-1-y]
+            np.testing.assert_array_equal(seen, entity.get_vision(env))
+
+    def testMultihop(self):
+        " Vision relayed through a chain of units"
+        board = np.zeros((20, 20), dtype=int)
+        board[:, 10:] = 1
+        board[0, 0], board[19, 19], board[18, 15] = 6, 7, 4
+        board[[2, 6, 10, 14], 2] = 2
+        env = gym.make(ENV_NAME, custom_board=board)
+        env.COM_GROUND = True
+        env.COM_DISTANCE = 4
+        env.reset(custom_board=board)
+        one_hop = [(entity.get_obs(env) != -1).sum() for entity in env._team_blue]
+        env.COM_MULTIHOP = True
+        env.reset(custom_board=board)
+        multi_hop = [(entity.get_obs(env) != -1).sum() for entity in env._team_blue]
+        self.assertTrue(all(m >= o for m, o in zip(multi_hop, one_hop)))
+        self.assertGreater(multi_hop[0], one_hop[0])
+
+    def testObservationCache(self):
+        " Observation is computed once per step and shared with the memory"
+        env = gym.make(ENV_NAME, policy_blue=policy.Random(), policy_red=policy.Random())
+        env.INDIV_MEMORY = "fog"
+        env.TEAM_MEMORY = "fog"
+        env.reset()
+        for _ in range(5):
+            env.step()
+            seen = np.zeros_like(env.blue_memory, dtype=bool)
+            for entity in env._team_blue:
+                obs = entity.get_obs(env)
+                self.assertIs(obs, entity.get_obs(env))
+                self.assertFalse(obs.flags.writeable)
+                seen |= entity.get_vision(env)
+            self.assertTrue((env.blue_memory[seen] == env._static_map[seen]).all())
+
+    def testLazyObservation(self):
+        " Lazy observations are computed on access, with the state of their own step"
+        env = gym.make(ENV_NAME, policy_blue=policy.Random(), policy_red=policy.Random())
+        self.assertIsInstance(env.reset(), np.ndarray)
+        self.assertIsInstance(env.step()[3]['action_mask'], np.ndarray)
+
+        for partial in [False, True]:
+            make = lambda: gym.make(ENV_NAME, policy_blue=policy.Spiral(), policy_red=policy.Spiral())
+            lazy, eager = make(), make()
+            lazy.LAZY_OBSERVATION = True
+            lazy.BLUE_PARTIAL = eager.BLUE_PARTIAL = partial
+            lazy.seed(3)
+            eager.seed(3)
+            handles = [(lazy.reset(custom_board='test_maps/board4.txt'), None)]
+            expected = [(eager.reset(custom_board='test_maps/board4.txt'), None)]
+            for _ in range(150):
+                s, r, d, i = lazy.step()
+                handles.append((s, i['action_mask']))
+                s, r, d, i = eager.step()
+                expected.append((s, i['action_mask']))
+                if d:
+                    break
+            for (obs, mask), (expected_obs, expected_mask) in zip(handles, expected):
+                self.assertFalse(obs.materialized)
+                self.assertEqual(obs.shape, expected_obs.shape)
+                np.testing.assert_array_equal(obs, expected_obs)
+                if mask is not None:
+                    np.testing.assert_array_equal(mask, expected_mask)
+            np.testing.assert_array_equal(handles[-1][0], lazy.get_obs_blue)
+
+    def testObservationType(self):
+        " Policies receive the observation they declare, and only that is computed"
+        class Recorder(policy.Zeros):
+            def gen_action(self, agent_list, observation, free_map=None):
+                self.observations.append(observation)
+                return super().gen_action(agent_list, observation)
+        for kind in [const.OBS_NONE, const.OBS_STATIC, const.OBS_FULL, const.OBS_PARTIAL, const.OBS_EGOCENTRIC]:
+            blue, red = Recorder(), Recorder()
+            blue.observations, red.observations = [], []
+            blue.observation_type = red.observation_type = kind
+            env = gym.make(ENV_NAME, policy_blue=blue, policy_red=red).unwrapped
+            env.LAZY_OBSERVATION = True
+            built = []
+            build_mask = env._observation_mask
+            env._observation_mask = lambda team: built.append(team) or build_mask(team)
+            env.step()
+            env.step()
+            self.assertEqual(len(built) > 0, kind == const.OBS_PARTIAL)
+            expected = env.get_obs_blue if kind == const.OBS_PARTIAL else \
+                       env.get_map if kind == const.OBS_STATIC else \
+                       env.get_full_state if kind == const.OBS_FULL else \
+                       [agent.get_obs(env) for agent in env._team_blue] if kind == const.OBS_EGOCENTRIC else None
+            env.step()
+            np.testing.assert_array_equal(blue.observations[-1], expected)
+
+    def testTeamViews(self):
+        " Both perspectives are produced together, red's with the team channels flipped"
+        env = gym.make(ENV_NAME, policy_blue=policy.Random(), policy_red=policy.Random())
+        for partial in [True, False]:
+            env.BLUE_PARTIAL = env.RED_PARTIAL = partial
+            env.reset()
+            for _ in range(5):
+                env.step()
+                views = env.get_obs_teams
+                np.testing.assert_array_equal(views[const.TEAM1_BACKGROUND], env.get_obs_blue)
+                np.testing.assert_array_equal(views[const.TEAM2_BACKGROUND], env.get_obs_red)
+            if not partial:
+                flipped = [const.CHANNEL[elem] for elem in [const.TEAM1_BACKGROUND, const.TEAM1_UGV, const.TEAM1_UAV, const.TEAM1_FLAG]]
+                np.testing.assert_array_equal(views[1][:, :, flipped], -views[0][:, :, flipped])
+
     @repeat(10)
     def testComAir(self):
         " Communication between ground and air test"